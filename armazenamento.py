@@ -0,0 +1,144 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+MAX_MENSAGENS_POR_USUARIO = 1000
+MAX_IDADE_MENSAGEM = 7 * 24 * 3600
+INTERVALO_EXPIRACAO = 60
+INTERVALO_CONFIRMACAO = 0.05
+LOTE_CONFIRMACAO = 500
+NOME_SEGURO = re.compile(r'[\w-]{1,64}')
+
+def nome_de_arquivo(nome):
+    # Nomes de usuário são texto livre: só viram nome de arquivo como estão se forem seguros
+    # (sem '/', '..' etc.); os demais são higienizados e ganham um resumo para não colidirem.
+    if NOME_SEGURO.fullmatch(nome):
+        return nome
+    legivel = re.sub(r'[^\w-]', '_', nome)[:32]
+    return f"{legivel}-{hashlib.sha256(nome.encode()).hexdigest()[:16]}"
+
+class CaixaPersistente:
+    # Caixas de entrada em SQLite, limitadas por usuário (as mais antigas saem primeiro)
+    # e por idade. Com caminho ':memory:' vira uma caixa limitada só em memória.
+    # A tabela `estado` guarda pequenos valores de texto por chave junto das mensagens.
+    # Uma contagem por dono fica em memória (lida do banco ao abrir): o DELETE dos excedentes
+    # só roda para quem passou do limite, e caixas vazias são respondidas sem consulta.
+    # As escritas são agrupadas numa transação aberta, confirmada a cada LOTE_CONFIRMACAO
+    # escritas ou INTERVALO_CONFIRMACAO segundos (a conexão enxerga as próprias escritas);
+    # uma queda do processo perde no máximo esse intervalo.
+    def __init__(self, caminho, max_por_usuario=MAX_MENSAGENS_POR_USUARIO, max_idade=MAX_IDADE_MENSAGEM):
+        self.max_por_usuario = max_por_usuario
+        self.max_idade = max_idade
+        self.lock = threading.Lock()
+        self.proxima_expiracao = time.monotonic() + INTERVALO_EXPIRACAO
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.execute("""
+            CREATE TABLE IF NOT EXISTS mensagens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dono TEXT NOT NULL,
+                criada REAL NOT NULL,
+                texto TEXT NOT NULL
+            )""")
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS mensagens_dono ON mensagens (dono, id)")
+        self.conexao.execute("CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        self._recontar()
+        self.escritas = 0
+        self.fechada = threading.Event()
+        threading.Thread(target=self._confirmar_periodicamente, name="caixa-commit", daemon=True).start()
+
+    def _escrever(self, sql, parametros):
+        # Chamar com self.lock. O lote cheio é confirmado antes do próximo comando, quando o
+        # cursor do anterior (ex.: um RETURNING) já foi lido.
+        if self.escritas >= LOTE_CONFIRMACAO:
+            self._confirmar()
+        if not self.conexao.in_transaction:
+            self.conexao.execute("BEGIN")
+        self.escritas += 1
+        return self.conexao.execute(sql, parametros)
+
+    def _confirmar(self):
+        if self.conexao.in_transaction:
+            self.conexao.execute("COMMIT")
+        self.escritas = 0
+
+    def _confirmar_periodicamente(self):
+        while not self.fechada.wait(INTERVALO_CONFIRMACAO):
+            with self.lock:
+                if not self.fechada.is_set():
+                    self._confirmar()
+
+    def adicionar(self, dono, texto):
+        with self.lock:
+            self._escrever("INSERT INTO mensagens (dono, criada, texto) VALUES (?, ?, ?)", (dono, time.time(), texto))
+            contagem = self.contagens.get(dono, 0) + 1
+            if contagem > self.max_por_usuario:
+                self._escrever("""
+                    DELETE FROM mensagens WHERE id IN (
+                        SELECT id FROM mensagens WHERE dono = ? ORDER BY id LIMIT ?
+                    )""", (dono, contagem - self.max_por_usuario))
+                contagem = self.max_por_usuario
+            self.contagens[dono] = contagem
+            # A limpeza por idade varre a tabela inteira: no máximo uma vez por INTERVALO_EXPIRACAO.
+            if time.monotonic() >= self.proxima_expiracao:
+                self.proxima_expiracao = time.monotonic() + INTERVALO_EXPIRACAO
+                self._escrever("DELETE FROM mensagens WHERE criada < ?", (time.time() - self.max_idade,))
+                self._recontar()
+
+    def _recontar(self):
+        self.contagens = dict(self.conexao.execute("SELECT dono, COUNT(*) FROM mensagens GROUP BY dono"))
+
+    def retirar(self, dono, limite=None):
+        with self.lock:
+            if not self.contagens.get(dono): return []
+            validade = time.time() - self.max_idade
+            if limite is None:
+                # Tudo sai de uma vez (inclusive as vencidas), num único comando.
+                linhas = sorted(self._escrever("DELETE FROM mensagens WHERE dono = ? RETURNING id, criada, texto", (dono,)).fetchall())
+                del self.contagens[dono]
+                return [texto for _, criada, texto in linhas if criada >= validade]
+            linhas = self.conexao.execute(
+                "SELECT id, texto FROM mensagens WHERE dono = ? AND criada >= ? ORDER BY id LIMIT ?",
+                (dono, validade, limite)).fetchall()
+            if linhas:
+                removidas = self._escrever("DELETE FROM mensagens WHERE dono = ? AND id <= ?", (dono, linhas[-1][0])).rowcount
+            else:
+                removidas = self._escrever("DELETE FROM mensagens WHERE dono = ? AND criada < ?", (dono, validade)).rowcount
+            self.contagens[dono] -= removidas
+            if not self.contagens[dono]:
+                del self.contagens[dono]
+            return [texto for _, texto in linhas]
+
+    def contar(self, dono):
+        with self.lock:
+            if not self.contagens.get(dono): return 0
+            return self.conexao.execute(
+                "SELECT COUNT(*) FROM mensagens WHERE dono = ? AND criada >= ?",
+                (dono, time.time() - self.max_idade)).fetchone()[0]
+
+    def total(self):
+        with self.lock:
+            return sum(self.contagens.values())
+
+    def tem_mensagens(self, dono):
+        # Pode contar mensagens vencidas ainda não limpas; retirar() as descarta.
+        with self.lock:
+            return self.contagens.get(dono, 0) > 0
+
+    def ler_estado(self, chave, padrao=None):
+        with self.lock:
+            linha = self.conexao.execute("SELECT valor FROM estado WHERE chave = ?", (chave,)).fetchone()
+            return linha[0] if linha is not None else padrao
+
+    def gravar_estado(self, chave, valor):
+        with self.lock:
+            self._escrever("INSERT OR REPLACE INTO estado (chave, valor) VALUES (?, ?)", (chave, valor))
+
+    def close(self):
+        with self.lock:
+            self.fechada.set()
+            self._confirmar()
+            self.conexao.close()
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from armazenamento import CaixaPersistente
+from benchmarks.broker_local import BrokerLocal
+from client_session import ClientSession, RPC_LONG_POLL_TIMEOUT
+from protocolo import ProxyJSONAssincrono, _Metodo
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERACOES = ('registrar', 'mover', 'enviar', 'receber', 'status')
+MIX_PADRAO = 'registrar=1,mover=4,enviar=4,receber=2,status=1'
+
+class Medicoes:
+    def __init__(self):
+        self.tempos = defaultdict(list)
+        self.erros = Counter()
+
+    def registrar(self, nome, segundos, erro=False):
+        self.tempos[nome].append(segundos)
+        if erro:
+            self.erros[nome] += 1
+
+    def limpar(self):
+        self.tempos.clear()
+        self.erros.clear()
+
+class ProxyMedido:
+    # Embrulha o proxy assíncrono e cronometra cada chamada RPC pelo nome do método.
+    def __init__(self, proxy, medicoes):
+        self._proxy = proxy
+        self._medicoes = medicoes
+
+    def __getattr__(self, nome):
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        return _Metodo(self._chamar, nome)
+
+    async def _chamar(self, metodo, params):
+        funcao = self._proxy
+        for parte in metodo.split('.'):
+            funcao = getattr(funcao, parte)
+        inicio = time.perf_counter()
+        try:
+            resultado = await funcao(*params)
+        except Exception:
+            self._medicoes.registrar(metodo, time.perf_counter() - inicio, erro=True)
+            raise
+        self._medicoes.registrar(metodo, time.perf_counter() - inicio)
+        return resultado
+
+class Simulacao:
+    # Todos os usuários virtuais compartilham um loop asyncio, como as sessões de um NetworkCore;
+    # cada worker é uma tarefa. No modelo 'compartilhado' as chamadas de todos passam por
+    # --conexoes conexões por nó e 'receber' é um poll sem espera; no modelo 'app' cada usuário
+    # tem o próprio proxy e uma conexão exclusiva em long-poll, como App._open_session.
+    def __init__(self, args, url):
+        self.args = args
+        self.broker = BrokerLocal()
+        self.url = url
+        self.pools = {}
+        self.proxies = {}
+        self.rpc = Medicoes()
+        self.ops = Medicoes()
+        self.buffer = CaixaPersistente(':memory:')
+        self.recebidas = Counter()
+        self.nomes = []
+        self.sequencia = 0
+        self.proxies_sessoes = []
+        self.long_polls = []
+        self.falhas_registro = 0
+
+    def _novo_nome(self):
+        self.sequencia += 1
+        nome = f"vu{self.sequencia}"
+        self.nomes.append(nome)
+        return nome
+
+    def proxy(self, url):
+        if url not in self.proxies:
+            self.pools[url] = ProxyJSONAssincrono(url, conexoes=self.args.conexoes, timeout=30)
+            self.proxies[url] = ProxyMedido(self.pools[url], self.rpc)
+        return self.proxies[url]
+
+    def fechar(self):
+        for tarefa in self.long_polls:
+            tarefa.cancel()
+        for pool in list(self.pools.values()) + self.proxies_sessoes:
+            pool.close()
+
+    def _proxy_proprio(self, url, **kwargs):
+        proxy = ProxyJSONAssincrono(url, **kwargs)
+        self.proxies_sessoes.append(proxy)
+        return ProxyMedido(proxy, self.rpc)
+
+    def _on_log(self, mensagem):
+        tipo = mensagem.split(']', 1)[0].lstrip('[')
+        self.recebidas[tipo] += 1
+
+    def _posicao(self, rnd):
+        return (self.args.lat + rnd.uniform(-self.args.area, self.args.area),
+                self.args.lon + rnd.uniform(-self.args.area, self.args.area))
+
+    async def nova_sessao(self, rnd):
+        nome = self._novo_nome()
+        lat, lon = self._posicao(rnd)
+        # Como o App: pergunta à porta de entrada qual nó atende o usuário (em cluster).
+        url = await self.proxy(self.url).no_responsavel(nome) or self.url
+        app = self.args.modelo == 'app'
+        proxy = self._proxy_proprio(url, timeout=30) if app else self.proxy(url)
+        sessao = ClientSession(nome, lat, lon, float(rnd.choice([5, 10, 20, 50])), proxy,
+                               self.broker.cliente(nome), self.buffer, on_log=self._on_log)
+        await sessao.start()
+        if app:
+            poll = self._proxy_proprio(url, conexoes=1, timeout=RPC_LONG_POLL_TIMEOUT + 10)
+            self.long_polls.append(asyncio.create_task(sessao.poll_rpc_messages(poll)))
+        return sessao
+
+    async def executar(self, operacao, sessao, sessoes, rnd):
+        if operacao == 'registrar':
+            sessoes.append(await self.nova_sessao(rnd))
+        elif operacao == 'mover':
+            await sessao.update_profile(sessao.lat + rnd.gauss(0, 0.02), sessao.lon + rnd.gauss(0, 0.02), sessao.raio)
+        elif operacao == 'enviar':
+            vizinhos = list(sessao.diretorio)
+            destino = rnd.choice(vizinhos) if vizinhos and rnd.random() < 0.8 else rnd.choice(self.nomes)
+            await sessao.send_message(destino, f"oi de {sessao.username}")
+        elif operacao == 'receber':
+            for _ in await sessao.fetch_rpc_messages():
+                self._on_log("[MSG SÍNCRONA]")
+        elif operacao == 'status':
+            await sessao.set_online(not sessao.is_online)
+
+    async def registrar_usuarios(self, indice, sessoes):
+        rnd = random.Random(indice)
+        for _ in range(self.args.usuarios // self.args.workers + (indice < self.args.usuarios % self.args.workers)):
+            try:
+                sessoes.append(await asyncio.wait_for(self.nova_sessao(rnd), self.args.timeout))
+            except Exception:
+                self.falhas_registro += 1
+
+    async def trabalhador(self, indice, sessoes, mix):
+        rnd = random.Random(-indice)
+        operacoes, pesos = zip(*mix.items())
+        fim = time.perf_counter() + self.args.duracao
+        while sessoes and time.perf_counter() < fim:
+            operacao = rnd.choices(operacoes, pesos)[0]
+            sessao = rnd.choice(sessoes)
+            inicio = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.executar(operacao, sessao, sessoes, rnd), self.args.timeout)
+                self.ops.registrar(operacao, time.perf_counter() - inicio)
+            except Exception:
+                self.ops.registrar(operacao, time.perf_counter() - inicio, erro=True)
+
+    async def rodar(self, mix):
+        sessoes = [[] for _ in range(self.args.workers)]
+        inicio = time.perf_counter()
+        await asyncio.gather(*(self.registrar_usuarios(i, sessoes[i]) for i in range(self.args.workers)))
+        tempo_registro = time.perf_counter() - inicio
+        print(f"{self.args.usuarios - self.falhas_registro} usuários virtuais registrados em {tempo_registro:.2f} s "
+              f"({self.args.usuarios / tempo_registro:.0f}/s)")
+        if self.falhas_registro:
+            print(f"{self.falhas_registro} usuários não conseguiram entrar em {self.args.timeout:.0f} s")
+        if self.long_polls:
+            print(f"{len(self.long_polls)} conexões presas em long-poll no servidor")
+        self.rpc.limpar()
+        self.ops.limpar()
+        await asyncio.gather(*(self.trabalhador(i, sessoes[i], mix) for i in range(self.args.workers)))
+        self.fechar()
+
+def percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+def imprimir_tabela(titulo, medicoes, duracao):
+    print(f"\n{titulo:<28} {'chamadas':>9} {'por s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'erros':>6}")
+    for nome, tempos in sorted(medicoes.tempos.items()):
+        tempos = sorted(tempos)
+        print(f"{nome:<28} {len(tempos):>9} {len(tempos) / duracao:>9.0f} {percentil(tempos, 0.5) * 1e3:>9.2f} "
+              f"{percentil(tempos, 0.99) * 1e3:>9.2f} {medicoes.erros[nome]:>6}")
+
+def ler_mix(texto):
+    mix = {}
+    for parte in texto.split(','):
+        operacao, _, peso = parte.partition('=')
+        if operacao not in OPERACOES:
+            raise argparse.ArgumentTypeError(f"operação desconhecida: {operacao} (use {', '.join(OPERACOES)})")
+        mix[operacao] = float(peso or 1)
+    return mix
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def iniciar_servidores(args):
+    # Um server_rpc.py por nó; com --nos > 1 eles formam um cluster.
+    portas = [porta_livre() for _ in range(args.nos)]
+    urls = [f"http://127.0.0.1:{porta}" for porta in portas]
+    dados = tempfile.mkdtemp(prefix='bench_carga_')
+    processos = []
+    for porta, url in zip(portas, urls):
+        comando = [sys.executable, os.path.join(RAIZ, 'server_rpc.py'), '--port', str(porta), '--modo', args.modo,
+                   '--threads', str(args.threads_servidor), '--dados', os.path.join(dados, str(porta))]
+        if args.nos > 1:
+            comando += ['--nos', ','.join(urls), '--no', url]
+        processos.append(subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=RAIZ))
+    for porta in portas:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            for processo in processos: processo.kill()
+            raise RuntimeError(f"servidor na porta {porta} não respondeu")
+    return processos, dados, urls[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga de usuários virtuais (ClientSession sem interface) contra o servidor RPC")
+    parser.add_argument('--url', help="servidor já em execução; sem isso, um server_rpc.py local é iniciado")
+    parser.add_argument('--modo', default='threads', help="modo do servidor iniciado localmente")
+    parser.add_argument('--threads-servidor', type=int, default=32)
+    parser.add_argument('--nos', type=int, default=1, help="quantos processos de servidor locais iniciar (cluster se > 1)")
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=16, help="tarefas asyncio gerando operações em paralelo")
+    parser.add_argument('--conexoes', type=int, default=16,
+                        help="conexões keep-alive por nó no modelo compartilhado")
+    parser.add_argument('--duracao', type=float, default=20.0)
+    parser.add_argument('--mix', type=ler_mix, default=None,
+                        help=f"pesos por operação (padrão: {MIX_PADRAO}; sem 'receber' no modelo app)")
+    parser.add_argument('--modelo', choices=('compartilhado', 'app'), default='compartilhado',
+                        help="compartilhado: todos os usuários dividem --conexoes conexões; app: como o cliente "
+                             "gráfico, cada usuário tem proxy próprio e uma conexão em long-poll")
+    parser.add_argument('--timeout', type=float, default=10.0,
+                        help="tempo máximo de cada operação; estourar conta como erro")
+    parser.add_argument('--lat', type=float, default=-3.74)
+    parser.add_argument('--lon', type=float, default=-38.52)
+    parser.add_argument('--area', type=float, default=5.0, help="meia-largura (graus) da área onde os usuários ficam")
+    args = parser.parse_args()
+    if args.mix is None:
+        args.mix = ler_mix(MIX_PADRAO)
+        if args.modelo == 'app':
+            # As mensagens síncronas chegam pelo long-poll de cada sessão.
+            del args.mix['receber']
+
+    processos, dados = [], None
+    url = args.url
+    if url is None:
+        processos, dados, url = iniciar_servidores(args)
+    try:
+        simulacao = Simulacao(args, url)
+        asyncio.run(simulacao.rodar(args.mix))
+        imprimir_tabela("método RPC", simulacao.rpc, args.duracao)
+        imprimir_tabela("operação do cliente", simulacao.ops, args.duracao)
+        print(f"\nMQTT: {next(simulacao.broker.publicadas)} publicações, {next(simulacao.broker.entregues)} entregas")
+        print("mensagens recebidas: " + ", ".join(f"{tipo}={n}" for tipo, n in sorted(simulacao.recebidas.items())))
+    finally:
+        for processo in processos:
+            processo.terminate()
+            processo.wait()
+        if dados is not None:
+            shutil.rmtree(dados, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
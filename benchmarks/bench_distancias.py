@@ -0,0 +1,53 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from utils import calcular_distancia, calcular_distancias, matriz_distancias
+
+def cronometrar(funcao, repeticoes):
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+def main():
+    parser = argparse.ArgumentParser(description="Distâncias: laço escalar x NumPy vetorizado")
+    parser.add_argument('--usuarios', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--raio', type=float, default=50.0, help="raio (km) usado no pré-filtro")
+    parser.add_argument('--matriz', type=int, nargs='+', default=[1000, 3000],
+                        help="quantidade de usuários na matriz de todos para todos")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+
+    lat, lon = -3.74, -38.52
+    print(f"{'usuarios':>9} {'escalar (ms)':>13} {'vetorizado (ms)':>16} {'c/ pré-filtro (ms)':>19} {'ganho':>8}")
+    for n in args.usuarios:
+        lats = [random.uniform(-60, 60) for _ in range(n)]
+        lons = [random.uniform(-180, 180) for _ in range(n)]
+        lats_np, lons_np = np.array(lats), np.array(lons)
+
+        escalar = cronometrar(lambda: [calcular_distancia(lat, lon, a, b) for a, b in zip(lats, lons)], args.repeticoes)
+        vetorizado = cronometrar(lambda: calcular_distancias(lat, lon, lats_np, lons_np), args.repeticoes)
+        filtrado = cronometrar(lambda: calcular_distancias(lat, lon, lats_np, lons_np, raio=args.raio), args.repeticoes)
+        print(f"{n:>9} {escalar * 1e3:>13.2f} {vetorizado * 1e3:>16.2f} {filtrado * 1e3:>19.2f} {escalar / filtrado:>7.0f}x")
+
+    # Matriz de todos para todos, com os usuários concentrados numa região como no cliente.
+    print(f"\n{'matriz':>9} {'completa (ms)':>14} {'c/ pré-filtro (ms)':>19} {'ganho':>8}")
+    for n in args.matriz:
+        lats = np.random.uniform(lat - 5, lat + 5, n)
+        lons = np.random.uniform(lon - 5, lon + 5, n)
+        completa = matriz_distancias(lats, lons, lats, lons)
+        filtrada = matriz_distancias(lats, lons, lats, lons, raio=args.raio)
+        dentro = completa <= args.raio
+        assert np.allclose(completa[dentro], filtrada[dentro]) and np.all(filtrada[~dentro] > args.raio)
+
+        tempo_completa = cronometrar(lambda: matriz_distancias(lats, lons, lats, lons), args.repeticoes)
+        tempo_filtrada = cronometrar(lambda: matriz_distancias(lats, lons, lats, lons, raio=args.raio), args.repeticoes)
+        print(f"{n:>6}x{n:<2} {tempo_completa * 1e3:>14.2f} {tempo_filtrada * 1e3:>19.2f} {tempo_completa / tempo_filtrada:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
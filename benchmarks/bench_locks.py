@@ -0,0 +1,61 @@
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+
+from server_rpc import LocationServer
+
+def carregar(servidor, usuarios):
+    for i in range(usuarios):
+        nome = f"u{i}"
+        servidor.registrar_usuario(nome, random.uniform(-60, 60), random.uniform(-180, 180), 50)
+        servidor.atualizar_status(nome, 'ONLINE')
+
+def trabalhador(servidor, nomes, todos, duracao, contagem, indice):
+    rnd = random.Random(indice)
+    fim = time.perf_counter() + duracao
+    ops = 0
+    while time.perf_counter() < fim:
+        nome = rnd.choice(nomes)
+        escolha = rnd.random()
+        if escolha < 0.4:
+            servidor.atualizar_localizacao(nome, rnd.uniform(-60, 60), rnd.uniform(-180, 180))
+        elif escolha < 0.8:
+            servidor.enviar_mensagem_sincrona(nome, rnd.choice(todos), "oi")
+        else:
+            servidor.receber_mensagens_sincronas(nome)
+        ops += 1
+    contagem[indice] = ops
+
+def medir(num_fatias, threads, usuarios, duracao):
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        servidor = LocationServer(num_fatias=num_fatias)
+        carregar(servidor, usuarios)
+        todos = list(servidor.usuarios)
+        contagem = [0] * threads
+        grupos = [todos[i::threads] for i in range(threads)]
+        ts = [threading.Thread(target=trabalhador, args=(servidor, grupos[i], todos, duracao, contagem, i))
+              for i in range(threads)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+    return sum(contagem) / duracao
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão de atualizações/envios no LocationServer por número de threads")
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--duracao', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--fatias', type=int, nargs='+', default=[1, 16],
+                        help="1 equivale ao lock global anterior")
+    args = parser.parse_args()
+
+    print(f"{'fatias':>6} {'threads':>7} {'ops/s':>12}")
+    for num_fatias in args.fatias:
+        for threads in args.threads:
+            vazao = medir(num_fatias, threads, args.usuarios, args.duracao)
+            print(f"{num_fatias:>6} {threads:>7} {vazao:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from persistencia import DiarioDeEstado
+from server_rpc import LocationServer
+
+def gerar_registro():
+    return {
+        'lat': random.uniform(-60, 60),
+        'lon': random.uniform(-180, 180),
+        'raio': float(random.choice([5, 10, 20, 50, 100])),
+        'status': random.choice(['ONLINE', 'OFFLINE']),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do WAL e tempo de recuperação do diretório (instantâneo + WAL)")
+    parser.add_argument('--usuarios', type=int, default=1000000)
+    parser.add_argument('--atualizacoes', type=int, default=200000)
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix='bench_persistencia_')
+    try:
+        usuarios = {f"usuario{i}": gerar_registro() for i in range(args.usuarios)}
+        diario = DiarioDeEstado(diretorio, limite_wal=args.atualizacoes + 1)
+        diario.carregar()
+
+        inicio = time.perf_counter()
+        geracao = diario.rotacionar()
+        diario.gravar_instantaneo(usuarios, geracao)
+        tempo_instantaneo = time.perf_counter() - inicio
+
+        nomes = list(usuarios)
+        atualizacoes = [(random.choice(nomes), gerar_registro()) for _ in range(args.atualizacoes)]
+        inicio = time.perf_counter()
+        for nome, dados in atualizacoes:
+            diario.registrar(nome, dados)
+        # O tempo do WAL inclui esvaziar a fila da thread de escrita.
+        diario.close()
+        tempo_wal = time.perf_counter() - inicio
+        for nome, dados in atualizacoes:
+            usuarios[nome] = dados
+
+        inicio = time.perf_counter()
+        recuperado = DiarioDeEstado(diretorio).carregar()
+        tempo_recuperacao = time.perf_counter() - inicio
+        assert recuperado == usuarios
+        del recuperado
+
+        # Inicialização real do servidor: recuperação mais índice espacial e log de versões.
+        inicio = time.perf_counter()
+        servidor = LocationServer(diario=DiarioDeEstado(diretorio))
+        tempo_servidor = time.perf_counter() - inicio
+        assert servidor.usuarios == usuarios
+        servidor.diario.close()
+
+        tamanho = os.path.getsize(os.path.join(diretorio, "estado.snap"))
+        print(f"{args.usuarios} usuários, {args.atualizacoes} atualizações no WAL")
+        print(f"instantâneo: {tamanho / 1e6:.1f} MB gravados em {tempo_instantaneo:.2f} s")
+        print(f"WAL: {args.atualizacoes / tempo_wal:,.0f} registros/s")
+        print(f"recuperação (instantâneo + WAL): {tempo_recuperacao:.2f} s")
+        print(f"inicialização do LocationServer: {tempo_servidor:.2f} s")
+    finally:
+        shutil.rmtree(diretorio)
+
+if __name__ == "__main__":
+    main()
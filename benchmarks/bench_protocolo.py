@@ -0,0 +1,55 @@
+import argparse
+import json
+import random
+import time
+import xmlrpc.client
+
+from protocolo import codificar_colunar, decodificar_colunar
+
+def gerar_diretorio(n):
+    return {
+        f"usuario{i}": {
+            'lat': random.uniform(-60, 60),
+            'lon': random.uniform(-180, 180),
+            'raio': float(random.choice([5, 10, 20, 50, 100])),
+            'status': random.choice(['ONLINE', 'OFFLINE']),
+        }
+        for i in range(n)
+    }
+
+def cronometrar(funcao, repeticoes):
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamanho e tempo de decodificação do diretório por formato de fio")
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    diretorio = gerar_diretorio(args.usuarios)
+    colunas = codificar_colunar(diretorio)
+    formatos = [
+        ("XML-RPC structs", xmlrpc.client.dumps((diretorio,), methodresponse=True, allow_none=True).encode(),
+         lambda dados: xmlrpc.client.loads(dados)[0][0]),
+        ("XML-RPC colunar", xmlrpc.client.dumps((colunas,), methodresponse=True, allow_none=True).encode(),
+         lambda dados: decodificar_colunar(xmlrpc.client.loads(dados)[0][0])),
+        ("JSON-RPC objetos", json.dumps({'jsonrpc': '2.0', 'result': diretorio, 'id': 1}).encode(),
+         lambda dados: json.loads(dados)['result']),
+        ("JSON-RPC colunar", json.dumps({'jsonrpc': '2.0', 'result': colunas, 'id': 1}).encode(),
+         lambda dados: decodificar_colunar(json.loads(dados)['result'])),
+    ]
+
+    print(f"{args.usuarios} usuários")
+    print(f"{'formato':<18} {'bytes':>10} {'decodificação (ms)':>19}")
+    for nome, dados, decodificar in formatos:
+        assert decodificar(dados) == diretorio
+        tempo = cronometrar(lambda: decodificar(dados), args.repeticoes)
+        print(f"{nome:<18} {len(dados):>10} {tempo * 1e3:>19.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+class _No:
+    __slots__ = ('filhos', 'assinantes', 'retida')
+
+    def __init__(self):
+        self.filhos = {}
+        self.assinantes = set()
+        self.retida = None
+
+def _casar_filtro(no, niveis, i, saida):
+    # Filtros (com + e #) guardados na árvore que casam com o tópico niveis[i:].
+    if '#' in no.filhos:
+        saida.extend(no.filhos['#'].assinantes)
+    if i == len(niveis):
+        saida.extend(no.assinantes)
+        return
+    for chave in (niveis[i], '+'):
+        filho = no.filhos.get(chave)
+        if filho is not None:
+            _casar_filtro(filho, niveis, i + 1, saida)
+
+def _casar_retidas(no, niveis, i, saida):
+    # Mensagens retidas cujo tópico casa com o filtro niveis[i:].
+    if i == len(niveis):
+        if no.retida is not None:
+            saida.append(no.retida)
+        return
+    if niveis[i] == '#':
+        pendentes = [no]
+        while pendentes:
+            atual = pendentes.pop()
+            if atual.retida is not None:
+                saida.append(atual.retida)
+            pendentes.extend(atual.filhos.values())
+        return
+    filhos = no.filhos.values() if niveis[i] == '+' else filter(None, [no.filhos.get(niveis[i])])
+    for filho in filhos:
+        _casar_retidas(filho, niveis, i + 1, saida)
+
+class BrokerLocal:
+    # Substituto do broker MQTT em memória para testes de carga: curingas (+ e #), mensagens
+    # retidas (payload vazio apaga) e Last Will. As entregas são síncronas, na thread de quem publica.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filtros = _No()
+        self.retidas = _No()
+        self.publicadas = itertools.count()
+        self.entregues = itertools.count()
+
+    def cliente(self, client_id, on_message_callback=None):
+        return ClienteLocal(self, client_id, on_message_callback)
+
+    def _no(self, raiz, topico):
+        no = raiz
+        for nivel in topico.split('/'):
+            no = no.filhos.setdefault(nivel, _No())
+        return no
+
+    def assinar(self, cliente, filtro):
+        with self.lock:
+            self._no(self.filtros, filtro).assinantes.add((cliente, filtro))
+            retidas = []
+            _casar_retidas(self.retidas, filtro.split('/'), 0, retidas)
+        for mensagem in retidas:
+            cliente._entregar(filtro, mensagem)
+
+    def cancelar(self, cliente, filtro):
+        with self.lock:
+            self._no(self.filtros, filtro).assinantes.discard((cliente, filtro))
+
+    def publicar(self, topico, payload, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        mensagem = SimpleNamespace(topic=topico, payload=payload, retain=False)
+        next(self.publicadas)
+        with self.lock:
+            if retain:
+                self._no(self.retidas, topico).retida = SimpleNamespace(topic=topico, payload=payload, retain=True) if payload else None
+            destinos = []
+            _casar_filtro(self.filtros, topico.split('/'), 0, destinos)
+        for cliente, filtro in destinos:
+            next(self.entregues)
+            cliente._entregar(filtro, mensagem)
+
+class ClienteLocal:
+    # Mesma interface do AsyncMQTTHandler, falando com um BrokerLocal.
+    def __init__(self, broker, client_id, on_message_callback=None):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_message = on_message_callback
+        self.callbacks = {}
+        self.will = None
+        self.on_reconnect = None
+
+    async def connect(self, will_topic=None, will_payload=None):
+        self.will = (will_topic, will_payload) if will_topic and will_payload else None
+        return True
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        self.broker.publicar(topic, payload, retain)
+
+    def subscribe(self, topic, qos=1, callback=None):
+        self.callbacks[topic] = callback
+        self.broker.assinar(self, topic)
+
+    def unsubscribe(self, topic):
+        self.callbacks.pop(topic, None)
+        self.broker.cancelar(self, topic)
+
+    async def reconnect_with_will(self, will_topic, will_payload):
+        await self.disconnect()
+        return await self.connect(will_topic=will_topic, will_payload=will_payload)
+
+    async def disconnect(self):
+        self.will = None
+
+    def drop(self):
+        # Queda sem desconexão limpa: o broker publica o Last Will.
+        if self.will:
+            self.broker.publicar(self.will[0], self.will[1], retain=True)
+        self.will = None
+
+    def _entregar(self, filtro, mensagem):
+        callback = self.callbacks.get(filtro) or self.on_message
+        if callback:
+            callback(self, None, mensagem)
@@ -1,17 +1,21 @@
 import customtkinter as ctk
-import xmlrpc.client
-import threading
 import time
-from mqtt_handler import MQTTHandler
-from utils import calcular_distancia
-import xml.parsers.expat
-
-RPC_URL = 'http://127.0.0.1:8000/RPC2'
+import os
+from mqtt_handler import AsyncMQTTHandler
+from protocolo import ProxyJSONAssincrono
+from lista_virtual import ListaVirtual
+from armazenamento import CaixaPersistente, nome_de_arquivo
+from client_session import ClientSession, RPC_LONG_POLL_TIMEOUT
+from network_core import NetworkCore
+
+RPC_URL = 'http://127.0.0.1:8000'
 MQTT_BROKER = 'broker.hivemq.com'
 MQTT_PORT = 1883
-MQTT_TOPIC_PRESENCE = 'ppd/projeto/presenca'
-MQTT_TOPIC_MSG_BASE = 'ppd/projeto/mensagens'
-MQTT_TOPIC_LOCATION_UPDATES = 'ppd/projeto/location_updates'
+RPC_TIMEOUT = 5
+CLIENT_DATA_DIR = os.path.join(os.path.expanduser("~"), ".comunicador-geografico")
+REPLAY_BATCH_SIZE = 200
+CONTACTS_REFRESH_INTERVAL = 0.5
+UI_DRAIN_INTERVAL_MS = 100
 
 COLOR_ERROR = "#C21807"
 COLOR_ONLINE = "#1F6AA5"
@@ -27,20 +31,21 @@ class App(ctk.CTk):
         self.lon = 0.0
         self.raio = 0.0
         self.selected_recipient = None
-        self.selected_contact_frame = None
-        self.is_online = True
         self.default_switch_progress_color = None
         self.default_switch_fg_color = None
-        self.message_buffer = []
+        self.session = None
+        self.contacts_dirty = False
+        self.last_contacts_refresh = 0.0
 
         self.title("Comunicador Geográfico - Login")
         self.geometry("400x450")
 
-        self.rpc_proxy = xmlrpc.client.ServerProxy(RPC_URL, allow_none=True)
-        self.mqtt_client = None
+        # Toda a rede roda no loop do NetworkCore; esta thread (Tk) nunca espera por E/S.
+        self.core = NetworkCore().start()
         self.is_running = True
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.create_login_widgets()
+        self.after(UI_DRAIN_INTERVAL_MS, self._drain_network_events)
 
     def create_login_widgets(self):
         self.login_frame = ctk.CTkFrame(self)
@@ -80,11 +85,72 @@ class App(ctk.CTk):
             return
         self.login_button.configure(state="disabled", text="Conectando...")
         self.status_label_login.configure(text="")
-        self.mqtt_client = MQTTHandler(MQTT_BROKER, MQTT_PORT, client_id=self.username, on_message_callback=self.on_mqtt_message)
+        self.core.submit(self._open_session(), self._on_session_opened)
+
+    async def _owner_node_url(self):
+        # Em cluster, cada usuário é atendido pelo nó dono dele; RPC_URL é só a porta de entrada.
+        # Servidor fora do ar ou sem cluster: segue com RPC_URL e o erro aparece na conexão.
+        seed = ProxyJSONAssincrono(RPC_URL, conexoes=1, timeout=RPC_TIMEOUT)
+        try:
+            return await seed.no_responsavel(self.username) or RPC_URL
+        except Exception:
+            return RPC_URL
+        finally:
+            seed.close()
+
+    async def _open_session(self):
+        # Roda no loop de rede: nada de widgets aqui. A caixa em disco também é aberta (e, se a
+        # sessão falhar, fechada) aqui, fora da thread do Tk.
+        os.makedirs(CLIENT_DATA_DIR, exist_ok=True)
+        message_buffer = CaixaPersistente(os.path.join(CLIENT_DATA_DIR, f"{nome_de_arquivo(self.username)}.db"))
+        try:
+            session = await self._start_session(message_buffer)
+        except Exception:
+            message_buffer.close()
+            raise
+        if session is None:
+            message_buffer.close()
+        return session
+
+    async def _start_session(self, message_buffer):
+        rpc_url = await self._owner_node_url()
+        session = ClientSession(self.username, self.lat, self.lon, self.raio,
+                                ProxyJSONAssincrono(rpc_url, timeout=RPC_TIMEOUT),
+                                AsyncMQTTHandler(MQTT_BROKER, MQTT_PORT, client_id=self.username), message_buffer,
+                                on_log=lambda message: self.core.post('log', message),
+                                on_directory_changed=self._request_contacts_refresh)
+        try:
+            started = await session.start()
+        except Exception:
+            session.rpc_proxy.close()
+            raise
+        if not started:
+            session.rpc_proxy.close()
+            return None
+        poll_proxy = ProxyJSONAssincrono(rpc_url, conexoes=1, timeout=RPC_LONG_POLL_TIMEOUT + RPC_TIMEOUT)
+        self.core.spawn(session.poll_rpc_messages(poll_proxy))
+        return session
+
+    def _on_session_opened(self, future):
+        try:
+            session = future.result()
+        except Exception as e:
+            print(f"Erro detalhado: {e}")
+            self.status_label_login.configure(text="Erro de conexão RPC.", text_color=COLOR_ERROR)
+            self.login_button.configure(state="normal", text="Tentar Novamente")
+            return
+        if session is None:
+            self.status_label_login.configure(text="Falha ao conectar ao Broker MQTT.", text_color=COLOR_ERROR)
+            self.login_button.configure(state="normal", text="Tentar Novamente")
+            return
+        self.session = session
         self.login_frame.destroy()
         self.title(f"Comunicador Geográfico - {self.username}")
         self.geometry("800x600")
-        self.initialize_connections()
+        self.setup_main_ui()
+        self.add_log(f"[RPC] Usuário '{self.username}' registrado.")
+        self.add_log("Bem-vindo! Conexões estabelecidas.")
+        self.add_log("[MQTT] Conectado e status 'ONLINE' anunciado.")
 
     def setup_main_ui(self):
         self.grid_columnconfigure(0, weight=1, minsize=250)
@@ -96,8 +162,8 @@ class App(ctk.CTk):
         left_frame.grid_rowconfigure(1, weight=1)
 
         ctk.CTkLabel(left_frame, text="Contatos", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, padx=10, pady=10)
-        self.contacts_frame = ctk.CTkScrollableFrame(left_frame)
-        self.contacts_frame.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        self.contacts_list = ListaVirtual(left_frame, COLOR_ONLINE, COLOR_OFFLINE, COLOR_SELECTED_BG, ao_selecionar=self._select_recipient)
+        self.contacts_list.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
 
         profile_frame = ctk.CTkFrame(left_frame)
         profile_frame.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
@@ -140,69 +206,65 @@ class App(ctk.CTk):
         self.message_entry.bind("<Return>", self.send_message_callback)
         self.send_button = ctk.CTkButton(right_frame, text="Enviar", width=100, command=self.send_message)
         self.send_button.grid(row=2, column=1, padx=(5, 10), pady=10, sticky="e")
-        self._update_contacts_list()
-
-    def _create_contact_item(self, parent_frame, username, status, distance=None):
-        color = COLOR_ONLINE if status == 'ONLINE' else COLOR_OFFLINE
-        item_frame = ctk.CTkFrame(parent_frame, fg_color="transparent", corner_radius=5)
-        item_frame.pack(fill="x", padx=5, pady=3)
-        item_frame.grid_columnconfigure(1, weight=1)
-        dot_label = ctk.CTkLabel(item_frame, text="●", text_color=color, font=ctk.CTkFont(size=18), fg_color="transparent")
-        dot_label.grid(row=0, column=0, sticky="w")
-        name_label = ctk.CTkLabel(item_frame, text=username, anchor="w", fg_color="transparent")
-        name_label.grid(row=0, column=1, sticky="w", padx=5)
-        if distance is not None:
-            dist_label = ctk.CTkLabel(item_frame, text=f"({distance:.2f} km)", anchor="e", font=ctk.CTkFont(size=10), text_color="gray", fg_color="transparent")
-            dist_label.grid(row=0, column=2, sticky="e", padx=5)
-            dist_label.bind("<Button-1>", lambda event, u=username, f=item_frame: self._select_recipient(u, f))
-        item_frame.bind("<Button-1>", lambda event, u=username, f=item_frame: self._select_recipient(u, f))
-        dot_label.bind("<Button-1>", lambda event, u=username, f=item_frame: self._select_recipient(u, f))
-        name_label.bind("<Button-1>", lambda event, u=username, f=item_frame: self._select_recipient(u, f))
-
-    def _select_recipient(self, username, frame):
-        if self.selected_contact_frame is not None:
-            try:
-                self.selected_contact_frame.configure(fg_color="transparent")
-            except ctk.TclError:
-                pass
-        frame.configure(fg_color=COLOR_SELECTED_BG)
-        self.selected_contact_frame = frame
+        self._request_contacts_refresh()
+
+    def _select_recipient(self, username):
         self.selected_recipient = username
         self.recipient_label.configure(text=f"Enviando para: {self.selected_recipient}", text_color=COLOR_SELECTED_TEXT)
 
     def _toggle_status(self):
-        self.is_online = not self.is_online
-        new_status = 'ONLINE' if self.is_online else 'OFFLINE'
+        is_online = not self.session.is_online
 
-        if self.is_online:
+        if is_online:
             self.status_switch.configure(text="Status Online", progress_color=self.default_switch_progress_color, fg_color=self.default_switch_fg_color)
         else:
             self.status_switch.configure(text="Status Offline", fg_color=COLOR_OFFLINE)
 
-        try:
-            self.rpc_proxy.atualizar_status(self.username, new_status)
-            self.mqtt_client.publish(MQTT_TOPIC_PRESENCE, f"{self.username}:{new_status}", retain=True)
+        self.status_switch.configure(state="disabled")
+        self.core.submit(self._set_online(is_online), lambda future: self._on_status_changed(future, is_online))
+
+    async def _set_online(self, is_online):
+        # Devolve quantas mensagens ficaram na caixa enquanto estava offline (None se ficou offline).
+        await self.session.set_online(is_online)
+        return self.session.message_buffer.contar(self.username) if is_online else None
 
-            if self.is_online:
+    def _on_status_changed(self, future, is_online):
+        self.status_switch.configure(state="normal")
+        if future.exception() is None:
+            if is_online:
                 self.add_log("[SISTEMA] Seu status foi alterado para ONLINE.")
-                self.add_log(f"[SISTEMA] Exibindo {len(self.message_buffer)} mensagens recebidas...")
-                for msg in self.message_buffer:
-                    self.add_log(f"[MSG ASSÍNCRONA] {msg}")
-                self.message_buffer.clear()
+                self.add_log(f"[SISTEMA] Exibindo {future.result()} mensagens recebidas...")
+                self._replay_buffered_messages()
             else:
                 self.add_log("[SISTEMA] Seu status foi alterado para OFFLINE (Invisível).")
                 self.add_log("[SISTEMA] Você não receberá novas mensagens até ficar online.")
-            
-        except Exception as e:
-            self.add_log(f"[ERRO] Falha ao atualizar status: {e}")
-            self.is_online = not self.is_online
-            if self.is_online:
+        else:
+            self.add_log(f"[ERRO] Falha ao atualizar status: {future.exception()}")
+            if self.session.is_online:
                 self.status_switch.select()
                 self.status_switch.configure(text="Status Online", progress_color=self.default_switch_progress_color, fg_color=self.default_switch_fg_color)
             else:
                 self.status_switch.deselect()
                 self.status_switch.configure(text="Status Offline", fg_color=COLOR_OFFLINE)
 
+    def _replay_buffered_messages(self):
+        # Cada lote sai da caixa no loop de rede e vira um add_log aqui; o próximo lote só é pedido
+        # depois, para a interface não travar.
+        self.core.submit(self._take_buffered_batch(), self._on_buffered_batch)
+
+    async def _take_buffered_batch(self):
+        return self.session.message_buffer.retirar(self.username, REPLAY_BATCH_SIZE)
+
+    def _on_buffered_batch(self, future):
+        if future.exception() is not None:
+            self.add_log(f"[ERRO] Falha ao ler as mensagens guardadas: {future.exception()}")
+            return
+        batch = future.result()
+        if not batch: return
+        self.add_log("\n".join(f"[MSG ASSÍNCRONA] {msg}" for msg in batch))
+        if len(batch) == REPLAY_BATCH_SIZE:
+            self._replay_buffered_messages()
+
     def _update_profile(self):
         new_lat_str = self.lat_entry_edit.get()
         new_lon_str = self.lon_entry_edit.get()
@@ -214,16 +276,13 @@ class App(ctk.CTk):
         except ValueError:
             self.add_log("[ERRO] Falha ao atualizar perfil: valores devem ser numéricos.")
             return
-        self.lat, self.lon, self.raio = new_lat, new_lon, new_raio
-        try:
-            self.rpc_proxy.atualizar_localizacao(self.username, self.lat, self.lon)
-            self.rpc_proxy.atualizar_raio(self.username, self.raio)
+        self.core.submit(self.session.update_profile(new_lat, new_lon, new_raio), self._on_profile_updated)
+
+    def _on_profile_updated(self, future):
+        if future.exception() is None:
             self.add_log("[SISTEMA] Perfil atualizado com sucesso no servidor.")
-            update_payload = f"{self.username}"
-            self.mqtt_client.publish(MQTT_TOPIC_LOCATION_UPDATES, update_payload)
-            self._update_contacts_list()
-        except Exception as e:
-            self.add_log(f"[ERRO] Falha ao comunicar atualização ao servidor: {e}")
+        else:
+            self.add_log(f"[ERRO] Falha ao comunicar atualização ao servidor: {future.exception()}")
 
     def add_log(self, message):
         self.log_textbox.configure(state="normal")
@@ -231,113 +290,54 @@ class App(ctk.CTk):
         self.log_textbox.configure(state="disabled")
         self.log_textbox.see("end")
 
-    def on_mqtt_message(self, client, userdata, message):
-        topic = message.topic
-        payload = message.payload.decode()
-        
-        if topic == MQTT_TOPIC_PRESENCE:
-            self.after(100, self._update_contacts_list)
-        
-        elif topic == MQTT_TOPIC_LOCATION_UPDATES:
-            updated_user = payload
-            if updated_user != self.username:
-                self.add_log(f"[SISTEMA] {updated_user} atualizou a localização. Atualizando lista...")
-                self.after(100, self._update_contacts_list)
-        
-        elif topic == f"{MQTT_TOPIC_MSG_BASE}/{self.username}":
-            if self.is_online:
-                self.add_log(f"[MSG ASSÍNCRONA] {payload}")
-            else:
-                self.message_buffer.append(payload)
-
-    def _update_contacts_list(self):
-        if not hasattr(self, 'contacts_frame'): return
-        
-        self.selected_recipient = None
-        self.selected_contact_frame = None
-        self.recipient_label.configure(text="Selecione um contato para enviar mensagem", text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
-
-        try:
-            all_users_data = self.rpc_proxy.get_todos_usuarios()
-        except Exception as e:
-            self.add_log(f"[ERRO] Falha ao buscar lista de usuários: {e}")
-            return
+    def _request_contacts_refresh(self):
+        # Chamado do loop de rede; só marca, quem redesenha é o _drain_network_events.
+        self.contacts_dirty = True
+
+    def _drain_network_events(self):
+        # Eventos da rede aplicados em lote na thread do Tk: um insert no log por rodada e
+        # no máximo um redesenho da lista de contatos a cada CONTACTS_REFRESH_INTERVAL.
+        lines = []
+        for kind, payload in self.core.drain():
+            if kind == 'log':
+                lines.append(payload)
+            elif kind == 'done':
+                self._flush_log(lines)
+                callback, future = payload
+                callback(future)
+        self._flush_log(lines)
+        now = time.monotonic()
+        if self.contacts_dirty and now - self.last_contacts_refresh >= CONTACTS_REFRESH_INTERVAL:
+            self.contacts_dirty = False
+            self.last_contacts_refresh = now
+            self._update_contacts_list()
+        if self.is_running:
+            self.after(UI_DRAIN_INTERVAL_MS, self._drain_network_events)
 
-        list_of_widgets = list(self.contacts_frame.winfo_children())
-        for widget in list_of_widgets:
-            widget.destroy()
-
-        online_in_radius, online_out_of_radius, offline_users = {}, {}, {}
-        for user, data in all_users_data.items():
-            if user == self.username: continue
-            if data['status'] == 'ONLINE':
-                dist = calcular_distancia(self.lat, self.lon, data['lat'], data['lon'])
-                if dist <= self.raio:
-                    online_in_radius[user] = {'data': data, 'dist': dist}
-                else:
-                    online_out_of_radius[user] = {'data': data, 'dist': dist}
-            else:
-                offline_users[user] = {'data': data}
-        
-        if online_in_radius:
-            ctk.CTkLabel(self.contacts_frame, text=f"Online (Dentro do Raio - {len(online_in_radius)})", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=5, pady=(5,2))
-            for user, info in sorted(online_in_radius.items()):
-                self._create_contact_item(self.contacts_frame, user, 'ONLINE', info['dist'])
-
-        if online_out_of_radius:
-            ctk.CTkLabel(self.contacts_frame, text=f"Online (Fora do Raio - {len(online_out_of_radius)})", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=5, pady=(15,2))
-            for user, info in sorted(online_out_of_radius.items()):
-                self._create_contact_item(self.contacts_frame, user, 'ONLINE', info['dist'])
-        
-        if offline_users:
-            ctk.CTkLabel(self.contacts_frame, text=f"Offline ({len(offline_users)})", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=5, pady=(15,2))
-            for user, info in sorted(offline_users.items()):
-                self._create_contact_item(self.contacts_frame, user, 'OFFLINE')
+    def _flush_log(self, lines):
+        if lines and hasattr(self, 'log_textbox'):
+            self.add_log("\n".join(lines))
+        lines.clear()
 
-    def initialize_connections(self):
-        try:
-            self.rpc_proxy.registrar_usuario(self.username, self.lat, self.lon, self.raio)
-            self.rpc_proxy.atualizar_status(self.username, 'ONLINE')
-            self.personal_topic = f"{MQTT_TOPIC_MSG_BASE}/{self.username}"
-            will_payload = f"{self.username}:OFFLINE"
-            connected = self.mqtt_client.connect(will_topic=MQTT_TOPIC_PRESENCE, will_payload=will_payload)
-            if connected:
-                self.setup_main_ui()
-                self.add_log(f"[RPC] Usuário '{self.username}' registrado.")
-                self.add_log("Bem-vindo! Conexões estabelecidas.")
-                self.mqtt_client.publish(MQTT_TOPIC_PRESENCE, f"{self.username}:ONLINE", retain=True)
-                self.mqtt_client.subscribe(MQTT_TOPIC_PRESENCE)
-                self.mqtt_client.subscribe(self.personal_topic)
-                self.mqtt_client.subscribe(MQTT_TOPIC_LOCATION_UPDATES)
-                self.add_log("[MQTT] Conectado e status 'ONLINE' anunciado.")
-            else:
-                self.create_login_widgets()
-                self.status_label_login.configure(text="Falha ao conectar ao Broker MQTT.", text_color=COLOR_ERROR)
-                return
-            self.rpc_polling_thread = threading.Thread(target=self.poll_rpc_messages, daemon=True)
-            self.rpc_polling_thread.start()
-        except Exception as e:
-            self.create_login_widgets()
-            self.status_label_login.configure(text="Erro de conexão RPC.", text_color=COLOR_ERROR)
-            print(f"Erro detalhado: {e}")
-            self.login_button.configure(state="normal", text="Tentar Novamente")
-
-    def poll_rpc_messages(self):
-        while self.is_running:
-            if not self.is_online: 
-                time.sleep(2)
-                continue
-            try:
-                messages = self.rpc_proxy.receber_mensagens_sincronas(self.username)
-                if messages:
-                    for msg in messages:
-                        self.after(0, self.add_log, f"[MSG SÍNCRONA] {msg}")
-            except xml.parsers.expat.ExpatError:
-                pass
-            except Exception as e:
-                self.after(0, self.add_log, f"[ERRO RPC POLLING] {e}")
-                time.sleep(5)
-            time.sleep(2)
+    def _update_contacts_list(self):
+        if not hasattr(self, 'contacts_list'): return
+        online_in_radius, online_out_of_radius, offline_users = self.session.partition_contacts()
+
+        items = []
+        for title, users in ((f"Online (Dentro do Raio - {len(online_in_radius)})", online_in_radius),
+                             (f"Online (Fora do Raio - {len(online_out_of_radius)})", online_out_of_radius),
+                             (f"Offline ({len(offline_users)})", offline_users)):
+            if not users: continue
+            items.append(('secao', title))
+            for user, (status, dist) in sorted(users.items()):
+                items.append(('contato', user, status, dist))
+
+        known = online_in_radius.keys() | online_out_of_radius.keys() | offline_users.keys()
+        if self.selected_recipient is not None and self.selected_recipient not in known:
+            self.selected_recipient = None
+            self.contacts_list.selecionar(None)
+            self.recipient_label.configure(text="Selecione um contato para enviar mensagem", text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
+        self.contacts_list.definir_itens(items)
 
     def send_message_callback(self, event):
         self.send_message()
@@ -351,47 +351,46 @@ class App(ctk.CTk):
         if not message:
             self.add_log("[SISTEMA] Digite uma mensagem para enviar.")
             return
-        try:
-            all_users = self.rpc_proxy.get_todos_usuarios()
-            recipient_data = all_users.get(recipient)
-            if not recipient_data:
-                self.add_log(f"[ERRO] Usuário '{recipient}' não encontrado no servidor.")
-                return
-            dist = calcular_distancia(self.lat, self.lon, recipient_data['lat'], recipient_data['lon'])
-            log_message = f"Você para {recipient}: {message}"
-            if recipient_data['status'] == 'ONLINE' and dist <= self.raio:
-                self.add_log(f"{log_message} (via RPC)")
-                self.rpc_proxy.enviar_mensagem_sincrona(self.username, recipient, message)
-            else:
-                self.add_log(f"{log_message} (via MQTT)")
-                recipient_topic = f"{MQTT_TOPIC_MSG_BASE}/{recipient}"
-                self.mqtt_client.publish(recipient_topic, f"(MQTT) {self.username}: {message}")
+        self.core.submit(self.session.send_message(recipient, message),
+                         lambda future: self._on_message_sent(future, recipient, message))
+
+    def _on_message_sent(self, future, recipient, message):
+        if future.exception() is not None:
+            self.add_log(f"[ERRO AO ENVIAR] {future.exception()}")
+            return
+        rota = future.result()
+        if rota == 'INEXISTENTE':
+            self.add_log(f"[ERRO] Usuário '{recipient}' não encontrado no servidor.")
+            return
+        self.add_log(f"Você para {recipient}: {message} (via {rota})")
+        # Só limpa se o usuário não começou a digitar outra mensagem enquanto esta era enviada.
+        if self.message_entry.get() == message:
             self.message_entry.delete(0, 'end')
-        except Exception as e:
-            self.add_log(f"[ERRO AO ENVIAR] {e}")
 
     def on_closing(self):
-        if self.username:
-            self.is_running = False
-            
-            self.withdraw() 
-
-            def cleanup_thread():
-                try:
-                    self.rpc_proxy.atualizar_status(self.username, 'OFFLINE')
-                    if self.mqtt_client:
-                        self.mqtt_client.publish(MQTT_TOPIC_PRESENCE, f"{self.username}:OFFLINE", retain=True)
-                        time.sleep(0.1)
-                        self.mqtt_client.disconnect()
-                    print(f"Limpeza em background para '{self.username}' concluída.")
-                except Exception as e:
-                    print(f"Erro durante a limpeza em background: {e}")
-                finally:
-                    self.after(0, self.destroy)
-
-            threading.Thread(target=cleanup_thread, daemon=True).start()
+        if self.session:
+            self.withdraw()
+            self.core.submit(self._stop_session(), self._on_session_stopped)
         else:
-            self.destroy()
+            self._shutdown()
+
+    async def _stop_session(self):
+        try:
+            await self.session.stop()
+        finally:
+            self.session.message_buffer.close()
+
+    def _on_session_stopped(self, future):
+        if future.exception() is None:
+            print(f"Limpeza em background para '{self.username}' concluída.")
+        else:
+            print(f"Erro durante a limpeza em background: {future.exception()}")
+        self._shutdown()
+
+    def _shutdown(self):
+        self.is_running = False
+        self.core.stop()
+        self.destroy()
 
 if __name__ == "__main__":
     app = App()
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import threading
+import time
+import xmlrpc.client
+from utils import chave_celula, chaves_celulas_no_raio
+from protocolo import TOPICO_MENSAGENS, codificar_presenca, decodificar_presenca
+from proximity import ProximityTracker
+
+MQTT_TOPIC_PRESENCE = 'ppd/projeto/presenca'
+MQTT_TOPIC_MSG_BASE = TOPICO_MENSAGENS
+MAX_CELL_SUBSCRIPTIONS = 64
+RPC_LONG_POLL_TIMEOUT = 20
+PRESENCE_LOG_WINDOW = 1.0
+
+class ClientSession:
+    # Estado e protocolo de um usuário conectado (RPC + MQTT), sem nenhuma dependência de interface.
+    # Roda inteira no loop asyncio do NetworkCore: `rpc_proxy` é um ProxyJSONAssincrono e
+    # `mqtt_client` um AsyncMQTTHandler (ou os substitutos dos benchmarks). `on_log` e
+    # `on_directory_changed` são chamados na thread do loop.
+    def __init__(self, username, lat, lon, raio, rpc_proxy, mqtt_client, message_buffer,
+                 on_log=print, on_directory_changed=None):
+        self.username = username
+        self.lat = lat
+        self.lon = lon
+        self.raio = raio
+        self.rpc_proxy = rpc_proxy
+        self.mqtt_client = mqtt_client
+        self.message_buffer = message_buffer
+        self.on_log = on_log
+        self.on_directory_changed = on_directory_changed or (lambda: None)
+        self.is_online = True
+        self.is_running = True
+        self.diretorio = {}
+        self.directory_lock = threading.Lock()
+        self.presence_version = 0
+        self.presence_cell = None
+        self.subscribed_cells = set()
+        self.personal_topic = f"{MQTT_TOPIC_MSG_BASE}/{username}"
+        self.proximity = ProximityTracker(lat, lon, raio, on_enter=self._on_enter_radius, on_leave=self._on_leave_radius)
+        self.radius_entered = []
+        self.radius_left = []
+        self.moved_users = []
+        self.presence_log_handle = None
+
+    async def start(self):
+        calls = [{'methodName': 'registrar_usuario', 'params': [self.username, self.lat, self.lon, self.raio]},
+                 {'methodName': 'atualizar_status', 'params': [self.username, 'ONLINE']}]
+        for result in await self.rpc_proxy.system.multicall(calls):
+            if isinstance(result, dict):
+                raise xmlrpc.client.Fault(result['faultCode'], result['faultString'])
+        self.presence_cell = chave_celula(self.lat, self.lon)
+        self.mqtt_client.on_reconnect = self._on_mqtt_reconnect
+        if not await self.mqtt_client.connect(will_topic=self._presence_topic(), will_payload=codificar_presenca('OFFLINE')):
+            return False
+        self.publish_presence('ONLINE')
+        # A sessão MQTT é persistente (clean_session=False, para a fila do tópico pessoal), então o
+        # broker ainda tem as assinaturas de presença da execução anterior: as que não valem mais
+        # são canceladas; as atuais são refeitas para registrar o callback e receber as retidas.
+        stale_cells = self._load_subscribed_cells()
+        self.update_cell_subscriptions()
+        for cell in stale_cells - self.subscribed_cells:
+            self.mqtt_client.unsubscribe(f"{MQTT_TOPIC_PRESENCE}/{cell}/+")
+        self.mqtt_client.subscribe(self.personal_topic, callback=self.on_personal_message)
+        return True
+
+    def _on_mqtt_reconnect(self):
+        # A queda fez o broker publicar o Last Will (OFFLINE, retido); se ele também perdeu a
+        # sessão, perdeu as assinaturas. Refaz as duas coisas.
+        for cell in self.subscribed_cells:
+            self.mqtt_client.subscribe(f"{MQTT_TOPIC_PRESENCE}/{cell}/+", callback=self.on_presence_message)
+        self.mqtt_client.subscribe(self.personal_topic, callback=self.on_personal_message)
+        self.publish_presence(self._status())
+
+    async def stop(self):
+        self.is_running = False
+        if self.presence_log_handle is not None:
+            self.presence_log_handle.cancel()
+        await self.rpc_proxy.atualizar_status(self.username, 'OFFLINE')
+        self.publish_presence('OFFLINE')
+        await self.mqtt_client.disconnect()
+
+    async def set_online(self, online):
+        status = 'ONLINE' if online else 'OFFLINE'
+        await self.rpc_proxy.atualizar_status(self.username, status)
+        self.is_online = online
+        self.publish_presence(status)
+
+    async def update_profile(self, lat, lon, raio):
+        self.lat, self.lon, self.raio = lat, lon, raio
+        await self.rpc_proxy.atualizar_perfil(self.username, lat, lon, raio)
+        if not await self._move_presence_cell():
+            self.publish_presence(self._status())
+        self.proximity.set_origin(lat, lon, raio)
+        self.update_cell_subscriptions()
+
+    async def send_message(self, recipient, message):
+        # Devolve a rota usada pelo servidor: 'RPC', 'MQTT' ou 'INEXISTENTE'.
+        rota = await self.rpc_proxy.enviar_se_no_raio(self.username, recipient, message)
+        if rota == 'MQTT_REMETENTE':
+            # Servidor sem conexão com o broker: a publicação na fila do destinatário fica conosco.
+            self.mqtt_client.publish(f"{MQTT_TOPIC_MSG_BASE}/{recipient}", f"(MQTT) {self.username}: {message}")
+            rota = 'MQTT'
+        return rota
+
+    async def fetch_rpc_messages(self, proxy=None, timeout=0):
+        return await (proxy or self.rpc_proxy).aguardar_mensagens(self.username, timeout)
+
+    async def poll_rpc_messages(self, proxy):
+        # `proxy` deve ser exclusivo do long-poll, senão ele ocupa uma conexão das chamadas normais.
+        while self.is_running:
+            if not self.is_online:
+                await asyncio.sleep(2)
+                continue
+            try:
+                for msg in await self.fetch_rpc_messages(proxy, RPC_LONG_POLL_TIMEOUT):
+                    self.on_log(f"[MSG SÍNCRONA] {msg}")
+            except Exception as e:
+                self.on_log(f"[ERRO RPC POLLING] {e}")
+                await asyncio.sleep(5)
+
+    def on_personal_message(self, client, userdata, message):
+        payload = message.payload.decode()
+        if self.is_online:
+            self.on_log(f"[MSG ASSÍNCRONA] {payload}")
+        else:
+            self.message_buffer.adicionar(self.username, payload)
+
+    def on_presence_message(self, client, userdata, message):
+        _, cell, user = message.topic.rsplit('/', 2)
+        if user == self.username: return
+        if not message.payload:
+            # Tópico limpo porque o usuário mudou de célula; só remove se ele ainda constar nesta.
+            with self.directory_lock:
+                removed = self.diretorio.get(user, {}).get('celula') == cell
+                if removed:
+                    del self.diretorio[user]
+            if removed:
+                self.proximity.remove(user)
+                self.on_directory_changed()
+            return
+        try:
+            data = decodificar_presenca(message.payload.decode())
+        except ValueError:
+            return
+
+        with self.directory_lock:
+            known = self.diretorio.get(user)
+            # Mensagens sem versão (o Last Will) são sempre aplicadas; as demais só se forem mais novas.
+            if known is not None and 'versao' in data and data['versao'] < known.get('versao', -1):
+                return
+            moved = known is not None and 'lat' in data and (data['lat'], data['lon']) != (known.get('lat'), known.get('lon'))
+            merged = self.diretorio[user] = {**(known or {}), **data, 'celula': cell}
+        self.proximity.update(user, merged['status'], merged.get('lat'), merged.get('lon'))
+        if moved:
+            self.moved_users.append(user)
+            self._schedule_presence_log()
+        self.on_directory_changed()
+
+    # Mudanças de localização e entradas e saídas do raio são agrupadas por PRESENCE_LOG_WINDOW:
+    # a carga das presenças retidas no login, o recálculo de set_origin e rajadas de
+    # movimentos viram uma linha por tipo, não uma por contato.
+    def _on_enter_radius(self, user, dist):
+        self.radius_entered.append((user, dist))
+        self._schedule_presence_log()
+
+    def _on_leave_radius(self, user):
+        self.radius_left.append(user)
+        self._schedule_presence_log()
+
+    def _schedule_presence_log(self):
+        if self.presence_log_handle is None:
+            self.presence_log_handle = asyncio.get_running_loop().call_later(PRESENCE_LOG_WINDOW, self._log_presence_changes)
+
+    def _log_presence_changes(self):
+        self.presence_log_handle = None
+        entered, self.radius_entered = self.radius_entered, []
+        left, self.radius_left = self.radius_left, []
+        moved, self.moved_users = self.moved_users, []
+        if len(moved) == 1:
+            self.on_log(f"[SISTEMA] {moved[0]} atualizou a localização. Atualizando lista...")
+        elif moved:
+            self.on_log(f"[SISTEMA] {len(moved)} contatos atualizaram a localização.")
+        if not entered and not left:
+            return
+        if len(entered) + len(left) == 1:
+            if entered:
+                user, dist = entered[0]
+                self.on_log(f"[SISTEMA] {user} entrou no seu raio ({dist:.1f} km).")
+            else:
+                self.on_log(f"[SISTEMA] {left[0]} saiu do seu raio.")
+            return
+        parts = []
+        if entered:
+            parts.append(f"{len(entered)} contatos entraram no seu raio")
+        if left:
+            parts.append(f"{len(left)} saíram" if entered else f"{len(left)} contatos saíram do seu raio")
+        self.on_log(f"[SISTEMA] {' e '.join(parts)}.")
+
+    def _status(self):
+        return 'ONLINE' if self.is_online else 'OFFLINE'
+
+    def _presence_topic(self, cell=None):
+        return f"{MQTT_TOPIC_PRESENCE}/{cell or self.presence_cell}/{self.username}"
+
+    def publish_presence(self, status):
+        self.presence_version = max(self.presence_version + 1, int(time.time() * 1000))
+        payload = codificar_presenca(status, self.lat, self.lon, self.raio, self.presence_version)
+        self.mqtt_client.publish(self._presence_topic(), payload, retain=True)
+
+    async def _move_presence_cell(self):
+        # Devolve True se mudou de célula (a presença nova já foi publicada).
+        new_cell = chave_celula(self.lat, self.lon)
+        if new_cell == self.presence_cell: return False
+        old_cell, self.presence_cell = self.presence_cell, new_cell
+        # Anuncia na célula nova antes de limpar a antiga: quem assina as duas não vê o usuário sumir.
+        self.publish_presence(self._status())
+        self.mqtt_client.publish(self._presence_topic(old_cell), b"", retain=True)
+        await self.mqtt_client.reconnect_with_will(self._presence_topic(), codificar_presenca('OFFLINE'))
+        return True
+
+    def _subscriptions_key(self):
+        return f"celulas_presenca:{self.username}"
+
+    def _load_subscribed_cells(self):
+        return set(json.loads(self.message_buffer.ler_estado(self._subscriptions_key(), '[]')))
+
+    def update_cell_subscriptions(self):
+        # Assina só as células que cobrem o raio; raios enormes caem para o curinga de célula.
+        cells = chaves_celulas_no_raio(self.lat, self.lon, self.raio)
+        if len(cells) > MAX_CELL_SUBSCRIPTIONS:
+            cells = {'+'}
+        for cell in self.subscribed_cells - cells:
+            self.mqtt_client.unsubscribe(f"{MQTT_TOPIC_PRESENCE}/{cell}/+")
+        for cell in cells - self.subscribed_cells:
+            self.mqtt_client.subscribe(f"{MQTT_TOPIC_PRESENCE}/{cell}/+", callback=self.on_presence_message)
+        if '+' not in cells:
+            with self.directory_lock:
+                gone = [u for u, data in self.diretorio.items() if data.get('celula') not in cells]
+                for user in gone:
+                    del self.diretorio[user]
+            for user in gone:
+                self.proximity.remove(user)
+        if cells != self.subscribed_cells:
+            self.message_buffer.gravar_estado(self._subscriptions_key(), json.dumps(sorted(cells)))
+        self.subscribed_cells = cells
+        self.on_directory_changed()
+
+    def partition_contacts(self):
+        # (online no raio, online fora do raio, offline), cada um {usuario: (status, distancia_ou_None)}.
+        return self.proximity.partitions()
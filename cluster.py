@@ -0,0 +1,97 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+
+from protocolo import PoolDeProxies, codificar_colunar
+
+REPLICAS_VIRTUAIS = 64
+TAMANHO_LOTE_REPLICACAO = 2000
+ESPERA_NOVA_TENTATIVA = 1.0
+
+log = logging.getLogger('cluster')
+
+def _hash(chave):
+    return int.from_bytes(hashlib.md5(chave.encode()).digest()[:8], 'big')
+
+class AnelDeHash:
+    # Hash consistente: cada nó ocupa `replicas` pontos no anel e um nome pertence ao primeiro
+    # ponto no sentido horário. Incluir ou remover um nó só move ~1/N dos usuários.
+    def __init__(self, nos, replicas=REPLICAS_VIRTUAIS):
+        pontos = sorted((_hash(f"{no}#{i}"), no) for no in nos for i in range(replicas))
+        self.hashes = [h for h, _ in pontos]
+        self.nos = [no for _, no in pontos]
+
+    def no_de(self, nome):
+        indice = bisect.bisect(self.hashes, _hash(nome)) % len(self.hashes)
+        return self.nos[indice]
+
+class Cluster:
+    # Visão de um nó sobre o cluster: quem é dono de cada usuário, proxies para os outros
+    # nós e a replicação assíncrona (uma fila coalescida por nó) dos registros locais.
+    # Todos os nós precisam ser iniciados com a mesma lista `nos`.
+    def __init__(self, proprio, nos, timeout=None, conexoes=32):
+        if proprio not in nos:
+            raise ValueError(f"o nó {proprio} não está na lista do cluster: {nos}")
+        self.proprio = proprio
+        self.anel = AnelDeHash(nos)
+        self.pares = [no for no in nos if no != proprio]
+        self.proxies = {no: PoolDeProxies(no, tamanho=conexoes, timeout=timeout) for no in self.pares}
+        self.lock = threading.Lock()
+        self.pendentes = {no: {} for no in self.pares}
+        self.sinais = {no: threading.Event() for no in self.pares}
+
+    def dono(self, nome):
+        return self.anel.no_de(nome)
+
+    def proxy_do_dono(self, nome):
+        # None quando o usuário é deste nó.
+        dono = self.anel.no_de(nome)
+        return None if dono == self.proprio else self.proxies[dono]
+
+    def iniciar(self, pedir_sincronizacao=True):
+        for no in self.pares:
+            threading.Thread(target=self._replicador, args=(no,), daemon=True, name=f"replicador-{no}").start()
+            if pedir_sincronizacao:
+                threading.Thread(target=self._sincronizar, args=(no,), daemon=True).start()
+
+    def replicar(self, nome, dados, destinos=None):
+        # Registros são imutáveis e só o mais recente de cada nome interessa: a fila é um dicionário.
+        with self.lock:
+            for no in destinos or self.pares:
+                self.pendentes[no][nome] = dados
+                self.sinais[no].set()
+
+    def _replicador(self, no):
+        while True:
+            self.sinais[no].wait()
+            with self.lock:
+                lote, self.pendentes[no] = self.pendentes[no], {}
+                self.sinais[no].clear()
+            nomes = list(lote)
+            try:
+                for inicio in range(0, len(nomes), TAMANHO_LOTE_REPLICACAO):
+                    parte = {nome: lote[nome] for nome in nomes[inicio:inicio + TAMANHO_LOTE_REPLICACAO]}
+                    self.proxies[no].replicar(self.proprio, codificar_colunar(parte))
+                    for nome in parte:
+                        del lote[nome]
+            except Exception as e:
+                log.warning("Falha ao replicar %d registros para %s: %s", len(lote), no, e)
+                with self.lock:
+                    # O que chegou enquanto isso é mais novo e tem precedência.
+                    for nome, dados in lote.items():
+                        self.pendentes[no].setdefault(nome, dados)
+                    self.sinais[no].set()
+                time.sleep(ESPERA_NOVA_TENTATIVA)
+
+    def _sincronizar(self, no):
+        # Pede ao par que reenvie a partição dele; a resposta chega pela fila de replicação normal.
+        while True:
+            try:
+                self.proxies[no].pedir_sincronizacao(self.proprio)
+                log.info("Sincronização solicitada a %s.", no)
+                return
+            except Exception as e:
+                log.debug("Nó %s indisponível para sincronizar: %s", no, e)
+                time.sleep(ESPERA_NOVA_TENTATIVA)
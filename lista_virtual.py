@@ -0,0 +1,109 @@
+import customtkinter as ctk
+
+ALTURA_LINHA = 30
+
+class ListaVirtual(ctk.CTkFrame):
+    # Lista rolável que só instancia as linhas visíveis e as reaproveita durante a rolagem.
+    # Itens: ('secao', titulo) ou ('contato', nome, status, distancia_ou_None).
+    def __init__(self, master, cor_online, cor_offline, cor_selecionado, ao_selecionar=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.cor_online = cor_online
+        self.cor_offline = cor_offline
+        self.cor_selecionado = cor_selecionado
+        self.ao_selecionar = ao_selecionar
+        self.fonte_secao = ctk.CTkFont(weight="bold")
+        self.fonte_contato = ctk.CTkFont()
+        self.itens = []
+        self.selecionado = None
+        self.linhas = []
+
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        cor_fundo = self._apply_appearance_mode(self.cget("fg_color"))
+        self.canvas = ctk.CTkCanvas(self, highlightthickness=0, bg=cor_fundo)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.barra = ctk.CTkScrollbar(self, command=self._rolar)
+        self.barra.grid(row=0, column=1, sticky="ns")
+        self.canvas.configure(yscrollcommand=self.barra.set)
+
+        self.canvas.bind("<Configure>", lambda event: self._redesenhar())
+        self._vincular_roda(self.canvas)
+
+    def _vincular_roda(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self._rolar("scroll", -1 if event.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda event: self._rolar("scroll", -1, "units"))
+        widget.bind("<Button-5>", lambda event: self._rolar("scroll", 1, "units"))
+
+    def _rolar(self, *args):
+        self.canvas.yview(*args)
+        self._redesenhar()
+
+    def definir_itens(self, itens):
+        self.itens = itens
+        altura = len(itens) * ALTURA_LINHA
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), altura), yscrollincrement=ALTURA_LINHA)
+        self._redesenhar()
+
+    def selecionar(self, nome):
+        self.selecionado = nome
+        self._redesenhar()
+
+    def _criar_linha(self):
+        frame = ctk.CTkFrame(self.canvas, fg_color="transparent", corner_radius=5, height=ALTURA_LINHA)
+        frame.grid_columnconfigure(1, weight=1)
+        frame.grid_propagate(False)
+        frame.grid_rowconfigure(0, weight=1)
+        ponto = ctk.CTkLabel(frame, text="", width=16, font=ctk.CTkFont(size=18), fg_color="transparent")
+        ponto.grid(row=0, column=0, sticky="w", padx=(5, 0))
+        nome = ctk.CTkLabel(frame, text="", anchor="w", fg_color="transparent")
+        nome.grid(row=0, column=1, sticky="w", padx=5)
+        distancia = ctk.CTkLabel(frame, text="", anchor="e", font=ctk.CTkFont(size=10), text_color="gray", fg_color="transparent")
+        distancia.grid(row=0, column=2, sticky="e", padx=5)
+        linha = {'frame': frame, 'ponto': ponto, 'nome': nome, 'distancia': distancia, 'item': None, 'selecionado': False}
+        for widget in (frame, ponto, nome, distancia):
+            widget.bind("<Button-1>", lambda event, l=linha: self._clique(l))
+            self._vincular_roda(widget)
+        linha['janela'] = self.canvas.create_window(0, 0, anchor="nw", window=frame)
+        return linha
+
+    def _clique(self, linha):
+        item = linha['item']
+        if item is None or item[0] != 'contato': return
+        self.selecionar(item[1])
+        if self.ao_selecionar:
+            self.ao_selecionar(item[1])
+
+    def _redesenhar(self):
+        largura = self.canvas.winfo_width()
+        visiveis = self.canvas.winfo_height() // ALTURA_LINHA + 2
+        while len(self.linhas) < visiveis:
+            self.linhas.append(self._criar_linha())
+
+        primeiro = int(self.canvas.canvasy(0)) // ALTURA_LINHA
+        for i, linha in enumerate(self.linhas):
+            indice = primeiro + i
+            if indice >= len(self.itens):
+                # Linhas sobrando ficam estacionadas acima da área rolável.
+                self.canvas.coords(linha['janela'], 0, -2 * ALTURA_LINHA)
+                linha['item'] = None
+                continue
+            self.canvas.coords(linha['janela'], 0, indice * ALTURA_LINHA)
+            self.canvas.itemconfigure(linha['janela'], width=largura)
+            self._preencher(linha, self.itens[indice])
+
+    def _preencher(self, linha, item):
+        selecionado = item[0] == 'contato' and item[1] == self.selecionado
+        if linha['item'] != item:
+            if item[0] == 'secao':
+                linha['ponto'].configure(text="")
+                linha['nome'].configure(text=item[1], font=self.fonte_secao)
+                linha['distancia'].configure(text="")
+            else:
+                _, nome, status, distancia = item
+                linha['ponto'].configure(text="●", text_color=self.cor_online if status == 'ONLINE' else self.cor_offline)
+                linha['nome'].configure(text=nome, font=self.fonte_contato)
+                linha['distancia'].configure(text="" if distancia is None else f"({distancia:.2f} km)")
+            linha['item'] = item
+        if linha['selecionado'] != selecionado:
+            linha['frame'].configure(fg_color=self.cor_selecionado if selecionado else "transparent")
+            linha['selecionado'] = selecionado
@@ -0,0 +1,183 @@
+import bisect
+import logging
+import threading
+import time
+
+LIMITES_SEGUNDOS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _chave(nome, rotulos):
+    return (nome, tuple(sorted(rotulos.items())))
+
+def _formatar(nome, rotulos, extra=()):
+    pares = list(rotulos) + list(extra)
+    if not pares:
+        return nome
+    return nome + '{' + ','.join(f'{chave}="{valor}"' for chave, valor in pares) + '}'
+
+class Histograma:
+    def __init__(self, limites=LIMITES_SEGUNDOS):
+        self.limites = limites
+        self.baldes = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.contagem = 0
+        self.lock = threading.Lock()
+
+    def observar(self, valor):
+        indice = bisect.bisect_left(self.limites, valor)
+        with self.lock:
+            self.baldes[indice] += 1
+            self.soma += valor
+            self.contagem += 1
+
+    def quantil(self, q):
+        # Estimativa pelo limite superior do balde onde o quantil cai.
+        with self.lock:
+            baldes, contagem = list(self.baldes), self.contagem
+        if contagem == 0:
+            return 0.0
+        alvo = q * contagem
+        acumulado = 0
+        for limite, quantidade in zip(self.limites, baldes):
+            acumulado += quantidade
+            if acumulado >= alvo:
+                return limite
+        return float('inf')
+
+class Metricas:
+    # Contadores, histogramas e medidores (lidos na hora da coleta) com rótulos, no formato
+    # de texto do Prometheus ou como dicionário para o RPC system.metricas.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.medidores = {}
+        self.ajudas = {}
+
+    def descrever(self, nome, ajuda):
+        self.ajudas[nome] = ajuda
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = _chave(nome, rotulos)
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def histograma(self, nome, **rotulos):
+        # Para caminhos quentes: guarde o histograma e chame observar() nele diretamente.
+        chave = _chave(nome, rotulos)
+        histograma = self.histogramas.get(chave)
+        if histograma is None:
+            with self.lock:
+                histograma = self.histogramas.setdefault(chave, Histograma())
+        return histograma
+
+    def observar(self, nome, valor, **rotulos):
+        self.histograma(nome, **rotulos).observar(valor)
+
+    def medidor(self, nome, funcao, ajuda=None):
+        self.medidores[nome] = funcao
+        if ajuda:
+            self.descrever(nome, ajuda)
+
+    def instantaneo(self):
+        with self.lock:
+            contadores = dict(self.contadores)
+            histogramas = dict(self.histogramas)
+        return {
+            'contadores': {_formatar(nome, rotulos): valor for (nome, rotulos), valor in contadores.items()},
+            'histogramas': {
+                _formatar(nome, rotulos): {'contagem': h.contagem, 'soma': h.soma, 'p50': h.quantil(0.5), 'p99': h.quantil(0.99)}
+                for (nome, rotulos), h in histogramas.items()
+            },
+            'medidores': {nome: funcao() for nome, funcao in self.medidores.items()},
+        }
+
+    def texto_prometheus(self):
+        with self.lock:
+            contadores = sorted(self.contadores.items())
+            histogramas = sorted(self.histogramas.items(), key=lambda item: item[0])
+        linhas = []
+        descritos = set()
+
+        def cabecalho(nome, tipo):
+            if nome in descritos: return
+            descritos.add(nome)
+            if nome in self.ajudas:
+                linhas.append(f"# HELP {nome} {self.ajudas[nome]}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+
+        for (nome, rotulos), valor in contadores:
+            cabecalho(nome, 'counter')
+            linhas.append(f"{_formatar(nome, rotulos)} {valor}")
+        for (nome, rotulos), h in histogramas:
+            cabecalho(nome, 'histogram')
+            with h.lock:
+                baldes, soma, contagem = list(h.baldes), h.soma, h.contagem
+            acumulado = 0
+            for limite, quantidade in zip(h.limites, baldes):
+                acumulado += quantidade
+                linhas.append(f"{_formatar(nome + '_bucket', rotulos, [('le', limite)])} {acumulado}")
+            linhas.append(f"{_formatar(nome + '_bucket', rotulos, [('le', '+Inf')])} {contagem}")
+            linhas.append(f"{_formatar(nome + '_sum', rotulos)} {soma}")
+            linhas.append(f"{_formatar(nome + '_count', rotulos)} {contagem}")
+        for nome, funcao in sorted(self.medidores.items()):
+            cabecalho(nome, 'gauge')
+            linhas.append(f"{nome} {funcao()}")
+        return "\n".join(linhas) + "\n"
+
+class LockMedido:
+    # Lock com tempo de espera e de posse medidos em histogramas; aceito por threading.Condition.
+    def __init__(self, metricas, nome):
+        self._lock = threading.Lock()
+        self._espera = metricas.histograma('lock_espera_segundos', lock=nome)
+        self._posse = metricas.histograma('lock_posse_segundos', lock=nome)
+        self._inicio_posse = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        inicio = time.perf_counter()
+        adquirido = self._lock.acquire(blocking, timeout)
+        if adquirido:
+            self._inicio_posse = time.perf_counter()
+            self._espera.observar(self._inicio_posse - inicio)
+        return adquirido
+
+    def release(self):
+        self._posse.observar(time.perf_counter() - self._inicio_posse)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def _is_owned(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class LimitadorDeTaxa(logging.Filter):
+    # Deixa passar no máximo `limite` registros por janela para cada mensagem-modelo;
+    # o primeiro registro da janela seguinte informa quantos foram suprimidos.
+    def __init__(self, limite=20, janela=1.0):
+        super().__init__()
+        self.limite = limite
+        self.janela = janela
+        self.lock = threading.Lock()
+        self.estado = {}
+
+    def filter(self, record):
+        agora = time.monotonic()
+        with self.lock:
+            inicio, emitidos, suprimidos = self.estado.get(record.msg, (agora, 0, 0))
+            if agora - inicio >= self.janela:
+                inicio, emitidos = agora, 0
+            if emitidos >= self.limite:
+                self.estado[record.msg] = (inicio, emitidos, suprimidos + 1)
+                return False
+            self.estado[record.msg] = (inicio, emitidos + 1, 0)
+        if suprimidos:
+            record.msg = f"{record.getMessage()} [+{suprimidos} mensagens semelhantes suprimidas]"
+            record.args = ()
+        return True
@@ -1,36 +1,110 @@
+import asyncio
 import paho.mqtt.client as mqtt
 
-class MQTTHandler:
+class AsyncMQTTHandler:
+    # Cliente MQTT do App sem thread própria: o socket do paho é atendido pelo loop asyncio
+    # (add_reader/add_writer) e os callbacks rodam na thread do loop.
+    # connect, reconnect_with_will e disconnect são corrotinas. `on_reconnect()` é chamado na
+    # thread do loop depois de cada reconexão automática.
     def __init__(self, broker, port, client_id, on_message_callback=None):
         self.broker = broker
         self.port = port
-        self.client = mqtt.Client(client_id=client_id, 
+        self.client = mqtt.Client(client_id=client_id,
                                   clean_session=False,
                                   callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
         if on_message_callback:
             self.client.on_message = on_message_callback
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.loop = None
+        self.closed = None
+        self.maintenance = None
+        self.on_reconnect = None
 
-    def connect(self, will_topic=None, will_payload=None):
+    def _no_loop(self, funcao, *args):
+        # O paho chama estes callbacks também de dentro do connect, que roda num executor; na
+        # thread do loop a chamada é imediata, porque o paho fecha o socket logo depois de avisar.
+        try:
+            no_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            no_loop = False
+        if no_loop:
+            funcao(*args)
+        else:
+            self.loop.call_soon_threadsafe(funcao, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._no_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._no_loop(self.loop.remove_reader, sock)
+        self._no_loop(self.closed.set)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._no_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._no_loop(self.loop.remove_writer, sock)
+
+    async def _maintain(self):
+        # Keepalive e, como o loop_start fazia, reconexão quando o broker derruba a conexão.
+        while True:
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                try:
+                    self.closed.clear()
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    print("Reconectado ao Broker MQTT.")
+                    if self.on_reconnect:
+                        self.on_reconnect()
+                except OSError as e:
+                    print(f"Falha ao reconectar ao Broker MQTT: {e}")
+            await asyncio.sleep(1)
+
+    async def connect(self, will_topic=None, will_payload=None):
+        self.loop = asyncio.get_running_loop()
+        self.closed = asyncio.Event()
         if will_topic and will_payload:
             print(f"Configurando Last Will: Tópico='{will_topic}', Mensagem='{will_payload}'")
             self.client.will_set(will_topic, payload=will_payload, qos=1, retain=True)
         try:
-            self.client.connect(self.broker, self.port, 60)
-            self.client.loop_start()
-            print("Conectado ao Broker MQTT com sucesso (Sessão Persistente).")
-            return True
+            await self.loop.run_in_executor(None, self.client.connect, self.broker, self.port, 60)
         except Exception as e:
             print(f"Falha ao conectar ao Broker MQTT: {e}")
             return False
+        self.maintenance = self.loop.create_task(self._maintain())
+        print("Conectado ao Broker MQTT com sucesso (Sessão Persistente).")
+        return True
 
     def publish(self, topic, payload, qos=1, retain=False):
         self.client.publish(topic, payload, qos=qos, retain=retain)
 
-    def subscribe(self, topic, qos=1):
+    def subscribe(self, topic, qos=1, callback=None):
+        if callback:
+            self.client.message_callback_add(topic, callback)
         self.client.subscribe(topic, qos=qos)
         print(f"Inscrito no tópico: {topic}")
 
-    def disconnect(self):
-        self.client.loop_stop()
+    def unsubscribe(self, topic):
+        self.client.message_callback_remove(topic)
+        self.client.unsubscribe(topic)
+        print(f"Inscrição cancelada no tópico: {topic}")
+
+    async def reconnect_with_will(self, will_topic, will_payload):
+        await self.disconnect()
+        return await self.connect(will_topic=will_topic, will_payload=will_payload)
+
+    async def disconnect(self):
+        # Espera o DISCONNECT sair (o paho fecha o socket em seguida); fechar antes
+        # faria o broker disparar o Last Will.
+        if self.maintenance:
+            self.maintenance.cancel()
+            self.maintenance = None
         self.client.disconnect()
-        print("Desconectado do Broker MQTT.")
\ No newline at end of file
+        if self.closed is None: return
+        try:
+            await asyncio.wait_for(self.closed.wait(), 2)
+        except asyncio.TimeoutError:
+            pass
+        print("Desconectado do Broker MQTT.")
@@ -0,0 +1,46 @@
+import asyncio
+import queue
+import threading
+
+class NetworkCore:
+    # Toda a E/S de rede do cliente (RPC e MQTT) roda num único loop asyncio, numa thread própria.
+    # A interface manda trabalho com submit() e recebe de volta eventos por uma fila thread-safe
+    # (drain()), que ela consome na própria thread; um processo pode hospedar várias sessões.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.events = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="network-core")
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, coro, on_done=None):
+        # `on_done(future)` é entregue pela fila de eventos, ou seja, na thread de quem chama drain().
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if on_done is not None:
+            future.add_done_callback(lambda f: self.events.put(('done', (on_done, f))))
+        return future
+
+    def spawn(self, coro):
+        # Para tarefas de longa duração criadas de dentro do loop (ex.: o long-poll de uma sessão).
+        return self.loop.create_task(coro)
+
+    def post(self, kind, payload=None):
+        self.events.put((kind, payload))
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
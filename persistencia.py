@@ -0,0 +1,172 @@
+import glob
+import os
+import struct
+import threading
+
+LIMITE_REGISTROS_WAL = 200000
+MAGICO_INSTANTANEO = b'PPDS1'
+
+# Registro: tamanho do nome (H), nome em UTF-8, lat, lon, raio (d) e online (B).
+_CABECALHO_REGISTRO = struct.Struct('<H')
+_CORPO_REGISTRO = struct.Struct('<dddB')
+_CABECALHO_INSTANTANEO = struct.Struct('<QQ')
+TAMANHO_MAXIMO_NOME = 0xFFFF
+
+def _codificar(nome, dados):
+    nome = nome.encode()
+    if len(nome) > TAMANHO_MAXIMO_NOME:
+        raise ValueError(f"nome com {len(nome)} bytes não cabe no registro do WAL (máximo {TAMANHO_MAXIMO_NOME})")
+    return (_CABECALHO_REGISTRO.pack(len(nome)) + nome +
+            _CORPO_REGISTRO.pack(dados['lat'], dados['lon'], dados['raio'], dados['status'] == 'ONLINE'))
+
+def _decodificar(buffer, inicio, usuarios):
+    # Aplica os registros de `buffer` a partir de `inicio`; um registro cortado no fim
+    # (queda no meio de uma escrita) é ignorado.
+    fim = len(buffer)
+    posicao = inicio
+    lidos = 0
+    while posicao + _CABECALHO_REGISTRO.size <= fim:
+        (tamanho,) = _CABECALHO_REGISTRO.unpack_from(buffer, posicao)
+        inicio_corpo = posicao + _CABECALHO_REGISTRO.size + tamanho
+        if inicio_corpo + _CORPO_REGISTRO.size > fim:
+            break
+        nome = bytes(buffer[posicao + _CABECALHO_REGISTRO.size:inicio_corpo]).decode()
+        lat, lon, raio, online = _CORPO_REGISTRO.unpack_from(buffer, inicio_corpo)
+        usuarios[nome] = {'lat': lat, 'lon': lon, 'raio': raio, 'status': 'ONLINE' if online else 'OFFLINE'}
+        posicao = inicio_corpo + _CORPO_REGISTRO.size
+        lidos += 1
+    return lidos
+
+class DiarioDeEstado:
+    # Log de escrita antecipada (WAL) + instantâneos compactados do diretório de usuários.
+    # Cada WAL tem uma geração no nome; o instantâneo guarda a geração a partir da qual
+    # os WALs ainda precisam ser reaplicados, então uma queda em qualquer ponto da
+    # compactação nunca reaplica registros antigos por cima de um instantâneo mais novo.
+    # registrar() só codifica e enfileira; a thread de escrita grava e faz flush da fila em
+    # lotes, fora dos locks de quem chama. Uma queda do processo perde só o que ainda estava na fila.
+    def __init__(self, diretorio, limite_wal=LIMITE_REGISTROS_WAL):
+        self.diretorio = diretorio
+        self.limite_wal = limite_wal
+        self.geracao = 0
+        self.registros_wal = 0
+        self.arquivo = None
+        self.em_compactacao = False
+        self.lock_instantaneo = threading.Lock()
+        # lock_escrita: arquivo atual e ordem das escritas; fila_mudou (com o próprio lock): a fila.
+        self.lock_escrita = threading.Lock()
+        self.fila_mudou = threading.Condition()
+        self.fila = []
+        self.escritor = None
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho_wal(self, geracao):
+        return os.path.join(self.diretorio, f"estado.{geracao:08d}.wal")
+
+    def _caminho_instantaneo(self):
+        return os.path.join(self.diretorio, "estado.snap")
+
+    def _wals(self):
+        return sorted(glob.glob(os.path.join(self.diretorio, "estado.*.wal")))
+
+    def carregar(self):
+        usuarios = {}
+        geracao_inicial = 0
+        caminho = self._caminho_instantaneo()
+        if os.path.exists(caminho):
+            with open(caminho, 'rb') as arquivo:
+                dados = memoryview(arquivo.read())
+            if bytes(dados[:len(MAGICO_INSTANTANEO)]) != MAGICO_INSTANTANEO:
+                raise ValueError(f"instantâneo inválido: {caminho}")
+            geracao_inicial, _ = _CABECALHO_INSTANTANEO.unpack_from(dados, len(MAGICO_INSTANTANEO))
+            _decodificar(dados, len(MAGICO_INSTANTANEO) + _CABECALHO_INSTANTANEO.size, usuarios)
+
+        self.geracao = geracao_inicial
+        for caminho in self._wals():
+            geracao = int(os.path.basename(caminho).split('.')[1])
+            if geracao < geracao_inicial:
+                os.remove(caminho)
+                continue
+            with open(caminho, 'rb') as arquivo:
+                _decodificar(memoryview(arquivo.read()), 0, usuarios)
+            self.geracao = max(self.geracao, geracao)
+
+        # Novas escritas sempre começam num WAL novo, nunca depois de um possível registro cortado.
+        self.geracao += 1
+        self.arquivo = open(self._caminho_wal(self.geracao), 'ab')
+        self.registros_wal = 0
+        self.escritor = threading.Thread(target=self._escrever, name="wal", daemon=True)
+        self.escritor.start()
+        return usuarios
+
+    def registrar(self, nome, dados):
+        # Quem chama serializa os registros (no LocationServer, o lock_diretorio). Um registro
+        # que não pode ser codificado levanta ValueError aqui, antes de entrar na fila.
+        registro = _codificar(nome, dados)
+        with self.fila_mudou:
+            self.fila.append(registro)
+            if len(self.fila) == 1:
+                self.fila_mudou.notify()
+        self.registros_wal += 1
+
+    def _descarregar(self):
+        # Chamar com lock_escrita.
+        with self.fila_mudou:
+            lote, self.fila = self.fila, []
+        if lote:
+            self.arquivo.write(b''.join(lote))
+            self.arquivo.flush()
+
+    def _escrever(self):
+        while True:
+            with self.fila_mudou:
+                self.fila_mudou.wait_for(lambda: self.fila or self.arquivo is None)
+            with self.lock_escrita:
+                if self.arquivo is None: return
+                self._descarregar()
+
+    def precisa_compactar(self):
+        return self.registros_wal >= self.limite_wal and not self.em_compactacao
+
+    def rotacionar(self):
+        # Fecha o WAL atual e abre o da próxima geração; devolve a geração que o
+        # instantâneo do estado atual vai cobrir. Também serializado por quem chama; o que
+        # estava na fila vai para o WAL antigo.
+        with self.lock_escrita:
+            self._descarregar()
+            self.arquivo.close()
+            self.geracao += 1
+            self.arquivo = open(self._caminho_wal(self.geracao), 'ab')
+        self.registros_wal = 0
+        self.em_compactacao = True
+        return self.geracao
+
+    def gravar_instantaneo(self, usuarios, geracao):
+        with self.lock_instantaneo:
+            try:
+                self._gravar_instantaneo(usuarios, geracao)
+            finally:
+                self.em_compactacao = False
+
+    def _gravar_instantaneo(self, usuarios, geracao):
+        caminho = self._caminho_instantaneo()
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(MAGICO_INSTANTANEO)
+            arquivo.write(_CABECALHO_INSTANTANEO.pack(geracao, len(usuarios)))
+            arquivo.writelines(_codificar(nome, dados) for nome, dados in usuarios.items())
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+        for wal in self._wals():
+            if int(os.path.basename(wal).split('.')[1]) < geracao:
+                os.remove(wal)
+
+    def close(self):
+        with self.lock_escrita:
+            if self.arquivo is None: return
+            self._descarregar()
+            self.arquivo.close()
+            with self.fila_mudou:
+                self.arquivo = None
+                self.fila_mudou.notify()
+        self.escritor.join()
@@ -0,0 +1,287 @@
+import asyncio
+import http.client
+import itertools
+import json
+import queue
+import threading
+import xmlrpc.client
+from urllib.parse import urlsplit
+
+CAMINHO_XML = '/RPC2'
+CAMINHO_JSON = '/JSON'
+TOPICO_MENSAGENS = 'ppd/projeto/mensagens'
+
+ERRO_PARSE = -32700
+ERRO_PEDIDO_INVALIDO = -32600
+ERRO_METODO = -32601
+ERRO_INTERNO = -32000
+
+def codificar_colunar(usuarios):
+    # {nome: {'lat','lon','raio','status'}} -> listas paralelas, bem menores no fio do que um struct por usuário.
+    nomes = list(usuarios)
+    return {
+        'nomes': nomes,
+        'lat': [usuarios[nome]['lat'] for nome in nomes],
+        'lon': [usuarios[nome]['lon'] for nome in nomes],
+        'raio': [usuarios[nome]['raio'] for nome in nomes],
+        'online': [1 if usuarios[nome]['status'] == 'ONLINE' else 0 for nome in nomes],
+    }
+
+def decodificar_colunar(colunas):
+    return {
+        nome: {'lat': lat, 'lon': lon, 'raio': raio, 'status': 'ONLINE' if online else 'OFFLINE'}
+        for nome, lat, lon, raio, online in zip(colunas['nomes'], colunas['lat'], colunas['lon'],
+                                                colunas['raio'], colunas['online'])
+    }
+
+def codificar_presenca(status, lat=None, lon=None, raio=None, versao=None):
+    # Campos ausentes não são enviados; quem recebe mescla com o que já sabe do usuário.
+    campos = {'status': status, 'lat': lat, 'lon': lon, 'raio': raio, 'versao': versao}
+    return json.dumps({chave: valor for chave, valor in campos.items() if valor is not None}, separators=(',', ':'))
+
+def decodificar_presenca(payload):
+    dados = json.loads(payload)
+    if not isinstance(dados, dict) or dados.get('status') not in ('ONLINE', 'OFFLINE'):
+        raise ValueError(f"payload de presença inválido: {payload!r}")
+    return dados
+
+def despachar_json(dispatcher, corpo):
+    try:
+        pedido = json.loads(corpo)
+    except ValueError as e:
+        return json.dumps(_erro(None, ERRO_PARSE, str(e)))
+    if isinstance(pedido, list) and pedido:
+        return json.dumps([_executar(dispatcher, item) for item in pedido])
+    return json.dumps(_executar(dispatcher, pedido))
+
+def _executar(dispatcher, pedido):
+    if (not isinstance(pedido, dict) or not isinstance(pedido.get('method'), str)
+            or not isinstance(pedido.get('params', []), list)):
+        id_pedido = pedido.get('id') if isinstance(pedido, dict) else None
+        return _erro(id_pedido, ERRO_PEDIDO_INVALIDO, "Invalid Request")
+    id_pedido = pedido.get('id')
+    try:
+        resultado = dispatcher._dispatch(pedido['method'], pedido.get('params', []))
+    except xmlrpc.client.Fault as e:
+        return _erro(id_pedido, e.faultCode, e.faultString)
+    except Exception as e:
+        codigo = ERRO_METODO if 'is not supported' in str(e) else ERRO_INTERNO
+        return _erro(id_pedido, codigo, f"{type(e).__name__}: {e}")
+    return {'jsonrpc': '2.0', 'result': resultado, 'id': id_pedido}
+
+def _erro(id_pedido, codigo, mensagem):
+    return {'jsonrpc': '2.0', 'error': {'code': codigo, 'message': mensagem}, 'id': id_pedido}
+
+class _Metodo:
+    def __init__(self, chamar, nome):
+        self._chamar = chamar
+        self._nome = nome
+
+    def __getattr__(self, nome):
+        return _Metodo(self._chamar, f"{self._nome}.{nome}")
+
+    def __call__(self, *args):
+        return self._chamar(self._nome, args)
+
+class ProxyJSON:
+    # Mesma interface de xmlrpc.client.ServerProxy (proxy.metodo(*args), erros como Fault),
+    # mas falando JSON-RPC 2.0 sobre uma única conexão HTTP/1.1 mantida aberta.
+    def __init__(self, url, timeout=None):
+        partes = urlsplit(url)
+        self._host = partes.hostname
+        self._porta = partes.port or 80
+        self._caminho = partes.path or CAMINHO_JSON
+        self._timeout = timeout
+        self._ids = itertools.count(1)
+        self._conexao = None
+
+    def __getattr__(self, nome):
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        return _Metodo(self._chamar, nome)
+
+    def _chamar(self, metodo, params):
+        corpo = json.dumps({'jsonrpc': '2.0', 'method': metodo, 'params': list(params), 'id': next(self._ids)})
+        try:
+            resposta = self._enviar(corpo)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # O servidor fecha conexões ociosas; uma nova tentativa em conexão limpa basta.
+            self.close()
+            resposta = self._enviar(corpo)
+        if 'error' in resposta:
+            raise xmlrpc.client.Fault(resposta['error']['code'], resposta['error']['message'])
+        return resposta['result']
+
+    def _enviar(self, corpo):
+        if self._conexao is None:
+            self._conexao = http.client.HTTPConnection(self._host, self._porta, timeout=self._timeout)
+        try:
+            self._conexao.request('POST', self._caminho, corpo.encode(), {'Content-Type': 'application/json'})
+            resposta = self._conexao.getresponse()
+            dados = resposta.read()
+        except Exception:
+            self.close()
+            raise
+        if resposta.status != 200:
+            raise xmlrpc.client.ProtocolError(self._host + self._caminho, resposta.status, resposta.reason, dict(resposta.getheaders()))
+        return json.loads(dados)
+
+    def close(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+class TransporteComTimeout(xmlrpc.client.Transport):
+    # O Transport padrão já reaproveita a conexão HTTP/1.1; aqui só se acrescenta o timeout.
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conexao = super().make_connection(host)
+        conexao.timeout = self.timeout
+        return conexao
+
+def _fechar(proxy):
+    if isinstance(proxy, xmlrpc.client.ServerProxy):
+        proxy('close')()
+    else:
+        proxy.close()
+
+def negociar_transporte(url_base, timeout=None):
+    # Usa JSON-RPC quando o servidor expõe /JSON, senão cai para XML-RPC.
+    # Devolve uma fábrica de proxies do transporte escolhido; servidor fora do ar propaga o OSError.
+    proxy = ProxyJSON(url_base + CAMINHO_JSON, timeout=timeout)
+    try:
+        proxy.system.listMethods()
+        return lambda: ProxyJSON(url_base + CAMINHO_JSON, timeout=timeout)
+    except (http.client.HTTPException, xmlrpc.client.ProtocolError, xmlrpc.client.Fault, ValueError):
+        return lambda: xmlrpc.client.ServerProxy(url_base + CAMINHO_XML, transport=TransporteComTimeout(timeout), allow_none=True)
+    finally:
+        proxy.close()
+
+class PoolDeProxies:
+    # Proxies (e suas conexões keep-alive) emprestados um por chamada, o que torna o
+    # pool seguro entre threads; no máximo `tamanho` chamadas simultâneas. É o cliente
+    # síncrono das chamadas entre nós do cluster, feitas das threads do servidor; o App
+    # usa o ProxyJSONAssincrono.
+    # O transporte só é negociado na primeira chamada, quando o servidor responder.
+    def __init__(self, url_base, tamanho=4, timeout=None):
+        self._url_base = url_base
+        self._timeout = timeout
+        self._fabrica = None
+        self._lock = threading.Lock()
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+
+    def __getattr__(self, nome):
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        return _Metodo(self._chamar, nome)
+
+    def _novo_proxy(self):
+        with self._lock:
+            if self._fabrica is None:
+                self._fabrica = negociar_transporte(self._url_base, self._timeout)
+        return self._fabrica()
+
+    def _chamar(self, metodo, params):
+        with self._vagas:
+            try:
+                proxy = self._livres.get_nowait()
+            except queue.Empty:
+                proxy = self._novo_proxy()
+            funcao = proxy
+            for parte in metodo.split('.'):
+                funcao = getattr(funcao, parte)
+            try:
+                resultado = funcao(*params)
+            except xmlrpc.client.Fault:
+                self._livres.put(proxy)
+                raise
+            except Exception:
+                # Conexão em estado desconhecido (timeout, reset): descarta em vez de devolver ao pool.
+                _fechar(proxy)
+                raise
+            self._livres.put(proxy)
+            return resultado
+
+    def close(self):
+        while True:
+            try:
+                _fechar(self._livres.get_nowait())
+            except queue.Empty:
+                return
+
+class ProxyJSONAssincrono:
+    # Versão asyncio do ProxyJSON (await proxy.metodo(*args)): JSON-RPC 2.0 sobre até
+    # `conexoes` conexões HTTP/1.1 keep-alive, sem bloquear o loop. Só fala com servidores
+    # que expõem /JSON; use dentro de um único loop asyncio.
+    def __init__(self, url_base, conexoes=4, timeout=None):
+        partes = urlsplit(url_base)
+        self._host = partes.hostname
+        self._porta = partes.port or 80
+        self._timeout = timeout
+        self._ids = itertools.count(1)
+        self._conexoes = conexoes
+        self._vagas = None
+        self._livres = []
+
+    def __getattr__(self, nome):
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        return _Metodo(self._chamar, nome)
+
+    async def _chamar(self, metodo, params):
+        if self._vagas is None:
+            self._vagas = asyncio.Semaphore(self._conexoes)
+        corpo = json.dumps({'jsonrpc': '2.0', 'method': metodo, 'params': list(params), 'id': next(self._ids)}).encode()
+        async with self._vagas:
+            try:
+                resposta = await self._enviar(corpo, reaproveitar=True)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # O servidor fecha conexões ociosas; uma nova tentativa em conexão limpa basta.
+                resposta = await self._enviar(corpo, reaproveitar=False)
+        if 'error' in resposta:
+            raise xmlrpc.client.Fault(resposta['error']['code'], resposta['error']['message'])
+        return resposta['result']
+
+    async def _enviar(self, corpo, reaproveitar):
+        if reaproveitar and self._livres:
+            leitor, escritor = self._livres.pop()
+        else:
+            leitor, escritor = await asyncio.wait_for(asyncio.open_connection(self._host, self._porta), self._timeout)
+        try:
+            escritor.write((f"POST {CAMINHO_JSON} HTTP/1.1\r\nHost: {self._host}:{self._porta}\r\n"
+                            f"Content-Type: application/json\r\nContent-Length: {len(corpo)}\r\n\r\n").encode() + corpo)
+            status, dados, manter = await asyncio.wait_for(self._ler_resposta(leitor, escritor), self._timeout)
+        except BaseException:
+            escritor.close()
+            raise
+        if manter:
+            self._livres.append((leitor, escritor))
+        else:
+            escritor.close()
+        if status != 200:
+            raise xmlrpc.client.ProtocolError(f"{self._host}{CAMINHO_JSON}", status, "", {})
+        return json.loads(dados)
+
+    async def _ler_resposta(self, leitor, escritor):
+        await escritor.drain()
+        linha = await leitor.readline()
+        if not linha:
+            raise ConnectionResetError("conexão fechada pelo servidor")
+        status = int(linha.split()[1])
+        cabecalhos = {}
+        while True:
+            linha = await leitor.readline()
+            if linha in (b'\r\n', b'\n', b''):
+                break
+            chave, _, valor = linha.decode('latin-1').partition(':')
+            cabecalhos[chave.strip().lower()] = valor.strip()
+        dados = await leitor.readexactly(int(cabecalhos.get('content-length', 0)))
+        return status, dados, cabecalhos.get('connection', '').lower() != 'close'
+
+    def close(self):
+        while self._livres:
+            self._livres.pop()[1].close()
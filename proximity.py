@@ -0,0 +1,73 @@
+import threading
+from utils import calcular_distancia
+
+IN_RADIUS, OUT_OF_RADIUS, OFFLINE = 0, 1, 2
+
+class ProximityTracker:
+    # Partição dos contatos (online no raio, online fora do raio, offline) mantida incrementalmente:
+    # cada atualização de presença mexe só no usuário dela (O(1)); todas as distâncias só são
+    # recalculadas quando a própria posição ou o raio mudam. `on_enter(usuario, distancia)` e
+    # `on_leave(usuario)` avisam quem entra ou sai do raio.
+    def __init__(self, lat, lon, raio, on_enter=None, on_leave=None):
+        self.lat = lat
+        self.lon = lon
+        self.raio = raio
+        self.on_enter = on_enter or (lambda user, dist: None)
+        self.on_leave = on_leave or (lambda user: None)
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.groups = ({}, {}, {})
+        self.group_of = {}
+
+    def _classify(self, status, lat, lon):
+        if status != 'ONLINE' or lat is None:
+            return OFFLINE, None
+        dist = calcular_distancia(self.lat, self.lon, lat, lon)
+        return (IN_RADIUS if dist <= self.raio else OUT_OF_RADIUS), dist
+
+    def _place(self, user, group, entry):
+        # Devolve o grupo anterior; chamar com o lock.
+        previous = self.group_of.get(user)
+        if previous is not None and previous != group:
+            del self.groups[previous][user]
+        self.groups[group][user] = entry
+        self.group_of[user] = group
+        return previous
+
+    def _notify(self, user, previous, group, dist):
+        if group == IN_RADIUS and previous != IN_RADIUS:
+            self.on_enter(user, dist)
+        elif previous == IN_RADIUS and group != IN_RADIUS:
+            self.on_leave(user)
+
+    def update(self, user, status, lat=None, lon=None):
+        group, dist = self._classify(status, lat, lon)
+        with self.lock:
+            self.positions[user] = (status, lat, lon)
+            previous = self._place(user, group, (status, dist))
+        self._notify(user, previous, group, dist)
+
+    def remove(self, user):
+        with self.lock:
+            self.positions.pop(user, None)
+            previous = self.group_of.pop(user, None)
+            if previous is not None:
+                del self.groups[previous][user]
+        if previous == IN_RADIUS:
+            self.on_leave(user)
+
+    def set_origin(self, lat, lon, raio):
+        if (lat, lon, raio) == (self.lat, self.lon, self.raio): return
+        self.lat, self.lon, self.raio = lat, lon, raio
+        changes = []
+        with self.lock:
+            for user, (status, user_lat, user_lon) in self.positions.items():
+                group, dist = self._classify(status, user_lat, user_lon)
+                changes.append((user, self._place(user, group, (status, dist)), group, dist))
+        for change in changes:
+            self._notify(*change)
+
+    def partitions(self):
+        # Cópias, para a interface ler de outra thread: {usuario: (status, distancia_ou_None)}.
+        with self.lock:
+            return tuple(dict(group) for group in self.groups)
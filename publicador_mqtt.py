@@ -0,0 +1,45 @@
+import logging
+import uuid
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+PORTA_PADRAO = 1883
+
+log = logging.getLogger('publicador_mqtt')
+
+def ler_endereco(texto):
+    host, _, porta = texto.partition(':')
+    return host, int(porta or PORTA_PADRAO)
+
+class PublicadorMQTT:
+    # Conexão do servidor com o broker, só para publicar na fila MQTT de cada destinatário.
+    # A thread do paho reconecta sozinha; enquanto estiver desconectado, publicar() devolve
+    # False e quem chamou escolhe outro caminho.
+    def __init__(self, host, porta=PORTA_PADRAO):
+        if mqtt is None:
+            raise RuntimeError("paho-mqtt não está instalado: o servidor não consegue publicar no broker")
+        self.endereco = f"{host}:{porta}"
+        self.cliente = mqtt.Client(client_id=f"servidor-{uuid.uuid4().hex[:12]}",
+                                   callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+        self.cliente.on_connect = self._ao_conectar
+        self.cliente.on_disconnect = self._ao_desconectar
+        self.cliente.connect_async(host, porta, 60)
+        self.cliente.loop_start()
+
+    def _ao_conectar(self, client, userdata, flags, reason_code, properties):
+        log.info("Conectado ao broker MQTT %s (%s).", self.endereco, reason_code)
+
+    def _ao_desconectar(self, client, userdata, flags, reason_code, properties):
+        log.warning("Desconectado do broker MQTT %s (%s).", self.endereco, reason_code)
+
+    def publicar(self, topico, payload):
+        if not self.cliente.is_connected():
+            return False
+        return self.cliente.publish(topico, payload, qos=1).rc == mqtt.MQTT_ERR_SUCCESS
+
+    def close(self):
+        self.cliente.disconnect()
+        self.cliente.loop_stop()
@@ -1,82 +1,738 @@
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import list_public_methods, resolve_dotted_attribute
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import selectors
+import socket
 import threading
-from collections import defaultdict
+import time
+import uuid
+import xmlrpc.client
+import zlib
+from collections import defaultdict, OrderedDict
+from utils import calcular_distancia, celula_da_posicao, faixas_no_raio
+from armazenamento import CaixaPersistente
+from persistencia import DiarioDeEstado
+from protocolo import CAMINHO_XML, CAMINHO_JSON, TOPICO_MENSAGENS, codificar_colunar, decodificar_colunar, despachar_json
+from metricas import Metricas, LockMedido, LimitadorDeTaxa
+from cluster import Cluster
+from publicador_mqtt import PublicadorMQTT, ler_endereco
+
+TEMPO_MAXIMO_ESPERA = 30
+TAMANHO_MAXIMO_NOME = 255
+NUM_FATIAS = 16
+LIMITE_CACHE_ALCANCE = 100_000
+
+TEMPO_OCIOSO_CONEXAO = 5
+CAMINHO_METRICAS = '/metrics'
+
+log = logging.getLogger('servidor_rpc')
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
-    rpc_paths = ('/RPC2',)
+    rpc_paths = (CAMINHO_XML, CAMINHO_JSON)
+    protocol_version = 'HTTP/1.1'
+    # Conexões keep-alive ociosas são fechadas logo para não acumular threads paradas.
+    timeout = TEMPO_OCIOSO_CONEXAO
+
+    def do_POST(self):
+        # Tempo da requisição inteira (decodificação + método + codificação); comparado com
+        # rpc_duracao_segundos, mostra quanto custa o protocolo.
+        inicio = time.perf_counter()
+        try:
+            self._post()
+        finally:
+            metricas = getattr(self.server, 'metricas', None)
+            if metricas is not None:
+                # Rótulos só com valores conhecidos: caminhos arbitrários criariam séries sem limite.
+                caminho = self.path if self.path in self.rpc_paths else 'outro'
+                metricas.observar('http_requisicao_segundos', time.perf_counter() - inicio, caminho=caminho)
+
+    def _tamanho_do_corpo(self):
+        tamanho = self.headers.get('content-length')
+        if tamanho is None:
+            self.send_error(411)
+            return None
+        if not tamanho.isdigit():
+            self.send_error(400)
+            return None
+        return int(tamanho)
+
+    def _post(self):
+        tamanho = self._tamanho_do_corpo()
+        if tamanho is None: return
+        if self.path != CAMINHO_JSON:
+            return super().do_POST()
+        self._enviar("application/json", despachar_json(self.server, self.rfile.read(tamanho)).encode())
+
+    def _enviar(self, tipo, resposta):
+        self.send_response(200)
+        self.send_header("Content-type", tipo)
+        self.send_header("Content-length", str(len(resposta)))
+        self.end_headers()
+        self.wfile.write(resposta)
+
+    def do_GET(self):
+        metricas = getattr(self.server, 'metricas', None)
+        if self.path != CAMINHO_METRICAS or metricas is None:
+            return self.report_404()
+        self._enviar("text/plain; version=0.0.4", metricas.texto_prometheus().encode())
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+class RequestHandlerPool(RequestHandler):
+    # Atende uma única requisição da conexão; o PoolXMLRPCServer decide o que fazer com ela depois.
+    # Um aguardar_mensagens isolado que teria de esperar fica estacionado em vez de prender a thread.
+    def handle(self):
+        self.estacionada = False
+        self.close_connection = True
+        self.handle_one_request()
+
+    def _post(self):
+        tamanho = self._tamanho_do_corpo()
+        if tamanho is None: return
+        if not self.is_rpc_path_valid():
+            return self.report_404()
+        corpo = self.decode_request_content(self.rfile.read(tamanho))
+        if corpo is None: return
+        espera = self._chamada_de_espera(corpo) if b'aguardar_mensagens' in corpo else None
+        if espera is not None and self.server.estacionar(self, *espera):
+            self.estacionada = True
+            return
+        try:
+            self._enviar(*self._despachar(corpo))
+        except Exception:
+            self.server.handle_error(self.request, self.client_address)
+            self.send_error(500)
+
+    def _chamada_de_espera(self, corpo):
+        # (nome, timeout, mesmo pedido com timeout 0) se o corpo for só um aguardar_mensagens.
+        try:
+            if self.path == CAMINHO_JSON:
+                pedido = json.loads(corpo)
+                if not isinstance(pedido, dict) or pedido.get('method') != 'aguardar_mensagens': return None
+                nome, timeout = pedido['params']
+                refeito = json.dumps({**pedido, 'params': [nome, 0]}).encode()
+            else:
+                (nome, timeout), metodo = xmlrpc.client.loads(corpo)
+                if metodo != 'aguardar_mensagens': return None
+                refeito = xmlrpc.client.dumps((nome, 0), metodo).encode()
+            return (nome, float(timeout), refeito) if isinstance(nome, str) else None
+        except (ValueError, TypeError, KeyError, xmlrpc.client.ResponseError):
+            return None
+
+    def _despachar(self, corpo):
+        if self.path == CAMINHO_JSON:
+            return "application/json", despachar_json(self.server, corpo).encode()
+        return "text/xml", self.server._marshaled_dispatch(corpo, getattr(self, '_dispatch', None), self.path)
+
+    def _resposta_http(self, tipo, resposta):
+        # Resposta de uma chamada estacionada, escrita direto no socket por outra thread.
+        cabecalhos = [f"{self.protocol_version} 200 OK", f"Content-type: {tipo}", f"Content-length: {len(resposta)}"]
+        if self.close_connection:
+            cabecalhos.append("Connection: close")
+        return ("\r\n".join(cabecalhos) + "\r\n\r\n").encode() + resposta
+
+class PoolXMLRPCServer(SimpleXMLRPCServer):
+    # Pool limitado que atende requisições, não conexões. Entre uma requisição e outra a conexão
+    # keep-alive espera num selector da thread vigia, sem ocupar o pool; um aguardar_mensagens
+    # sem nada a entregar fica estacionado na instância (LocationServer._estacionar_espera) até
+    # chegar mensagem, mudar o status ou vencer o prazo, e então é respondido refazendo a chamada
+    # com timeout 0. Em cluster, um long-poll encaminhado a outro nó ainda segura a thread.
+    request_queue_size = 128
+
+    def __init__(self, addr, max_threads=32, **kwargs):
+        # Antes do super(): se o bind falhar, server_close() já encontra o pool e a vigia.
+        self.pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="rpc")
+        self.seletor = selectors.DefaultSelector()
+        self.despertador, self.sinal = socket.socketpair()
+        self.despertador.setblocking(False)
+        self.seletor.register(self.despertador, selectors.EVENT_READ)
+        self.tarefas_vigia = queue.SimpleQueue()
+        self.ociosas = OrderedDict()
+        self.prazos = []
+        self.sequencia = itertools.count()
+        self.fechado = False
+        kwargs.setdefault('requestHandler', RequestHandlerPool)
+        super().__init__(addr, **kwargs)
+        threading.Thread(target=self._vigiar, name="rpc-vigia", daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._atender, request, client_address)
+
+    def _atender(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        if not handler.estacionada:
+            self._liberar(handler)
+
+    def _liberar(self, handler):
+        if handler.close_connection or self.fechado:
+            self.shutdown_request(handler.request)
+        else:
+            self._na_vigia(self._guardar_ociosa, handler.request, handler.client_address)
+
+    def estacionar(self, handler, nome, timeout, refeito):
+        instancia = getattr(self, 'instance', None)
+        if not hasattr(instancia, '_estacionar_espera'): return False
+        espera = instancia._estacionar_espera(nome, timeout, lambda: self._responder_depois(handler, refeito))
+        if espera is None: return False
+        self._na_vigia(self._agendar_prazo, espera, handler, refeito)
+        return True
+
+    def _responder_depois(self, handler, refeito):
+        try:
+            self.pool.submit(self._responder, handler, refeito)
+        except RuntimeError:
+            # Pool já encerrado: o servidor está fechando.
+            self.shutdown_request(handler.request)
+
+    def _responder(self, handler, refeito):
+        try:
+            handler.request.sendall(handler._resposta_http(*handler._despachar(refeito)))
+        except OSError:
+            handler.close_connection = True
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            handler.close_connection = True
+        self._liberar(handler)
+
+    # Tudo abaixo roda na thread vigia; as outras threads só chegam aqui por _na_vigia().
+    def _na_vigia(self, funcao, *args):
+        self.tarefas_vigia.put((funcao, args))
+        try:
+            self.sinal.send(b'\0')
+        except OSError:
+            pass
+
+    def _guardar_ociosa(self, request, client_address):
+        self.ociosas[request] = time.monotonic()
+        self.seletor.register(request, selectors.EVENT_READ, client_address)
+
+    def _agendar_prazo(self, espera, handler, refeito):
+        heapq.heappush(self.prazos, (espera.prazo, next(self.sequencia), espera, handler, refeito))
+
+    def _vigiar(self):
+        while not self.fechado:
+            intervalo = 1.0 if not self.prazos else min(1.0, max(0.0, self.prazos[0][0] - time.monotonic()))
+            for chave, _ in self.seletor.select(intervalo):
+                if chave.fileobj is self.despertador:
+                    try:
+                        while self.despertador.recv(4096): pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                self.seletor.unregister(chave.fileobj)
+                del self.ociosas[chave.fileobj]
+                if not self.fechado:
+                    self.pool.submit(self._atender, chave.fileobj, chave.data)
+            while not self.tarefas_vigia.empty():
+                funcao, args = self.tarefas_vigia.get()
+                funcao(*args)
+            agora = time.monotonic()
+            while self.prazos and self.prazos[0][0] <= agora:
+                _, _, espera, handler, refeito = heapq.heappop(self.prazos)
+                if self.instance._cancelar_espera(espera):
+                    self._responder_depois(handler, refeito)
+            # Conexões keep-alive ociosas há mais de TEMPO_OCIOSO_CONEXAO; as mais antigas vêm primeiro.
+            while self.ociosas and next(iter(self.ociosas.values())) < agora - TEMPO_OCIOSO_CONEXAO:
+                request, _ = self.ociosas.popitem(last=False)
+                self.seletor.unregister(request)
+                self.shutdown_request(request)
+        for request in self.ociosas:
+            self.shutdown_request(request)
+        self.seletor.close()
+        self.despertador.close()
+        self.sinal.close()
+
+    def server_close(self):
+        super().server_close()
+        self.fechado = True
+        self._na_vigia(lambda: None)
+        self.pool.shutdown(wait=False)
+
+MODOS_SERVIDOR = ('simples', 'threads', 'pool')
+
+class Espera:
+    # aguardar_mensagens estacionado: `ao_acordar` é chamado uma única vez, com o lock da fatia.
+    def __init__(self, nome, status_inicial, prazo, ao_acordar):
+        self.nome = nome
+        self.status_inicial = status_inicial
+        self.prazo = prazo
+        self.ao_acordar = ao_acordar
+
+class Fatia:
+    def __init__(self, metricas, caixa):
+        self.lock = LockMedido(metricas, 'fatia')
+        self.caixa = caixa
+        self.condicoes = {}
+        self.esperas = {}
+
+    def condicao(self, nome):
+        if nome not in self.condicoes:
+            self.condicoes[nome] = threading.Condition(self.lock)
+        return self.condicoes[nome]
 
 class LocationServer:
-    def __init__(self):
-        self.lock = threading.Lock()
+    # Cada usuário pertence a uma fatia (lock, condições e CaixaPersistente próprios); a caixa
+    # de entrada do usuário fica no banco da fatia dele, acessado só com o lock da fatia.
+    # Os registros em self.usuarios nunca são alterados no lugar: cada atualização
+    # troca o dicionário inteiro, então leituras podem dispensar locks.
+    # self.lock_diretorio protege inserções, índice espacial e log de versões;
+    # a ordem de aquisição é sempre fatia -> diretório.
+    # Em cluster, cada nó é dono de uma parte dos usuários (escritas, caixas de entrada e
+    # long-polls deles) e guarda réplicas do resto do diretório; chamadas sobre usuários
+    # de outro nó são encaminhadas ao dono.
+    # Com um `publicador`, o próprio servidor entrega as mensagens assíncronas no broker.
+    def __init__(self, num_fatias=NUM_FATIAS, caixas=None, diario=None, metricas=None, cluster=None, publicador=None):
+        self.metricas = metricas if metricas is not None else Metricas()
+        self.cluster = cluster
+        self.publicador = publicador
+        self.cache_alcance = {}
+        if caixas is None:
+            caixas = [CaixaPersistente(':memory:') for _ in range(num_fatias)]
+        if len(caixas) != num_fatias:
+            raise ValueError(f"{len(caixas)} caixas para {num_fatias} fatias")
+        self.fatias = [Fatia(self.metricas, caixa) for caixa in caixas]
+        self.lock_diretorio = LockMedido(self.metricas, 'diretorio')
         self.usuarios = {}
-        self.caixas_de_entrada_rpc = defaultdict(list)
-        print("Servidor RPC (Gerenciamento e Chat Síncrono) inicializado.")
+        self.online = 0
+        self.indice_espacial = defaultdict(set)
+        self.celulas = {}
+        self.instancia = uuid.uuid4().hex
+        self.versao = 0
+        self.alteracoes = OrderedDict()
+        self.instantaneo = {}
+        self.versao_instantaneo = 0
+        self.diario = diario
+        if diario is not None:
+            # Carga em bloco, equivalente a _indexar + _marcar_alteracao para cada usuário.
+            self.usuarios = diario.carregar()
+            for nome, dados in self.usuarios.items():
+                celula = self.celulas[nome] = celula_da_posicao(dados['lat'], dados['lon'])
+                self.indice_espacial[celula].add(nome)
+            self.online = sum(dados['status'] == 'ONLINE' for dados in self.usuarios.values())
+            self.alteracoes = OrderedDict(zip(self.usuarios, range(1, len(self.usuarios) + 1)))
+            self.versao = len(self.usuarios)
+        self._registrar_metricas()
+        log.info("Servidor RPC (Gerenciamento e Chat Síncrono) inicializado com %d usuários.", len(self.usuarios))
+
+    def _registrar_metricas(self):
+        m = self.metricas
+        m.descrever('rpc_duracao_segundos', "Tempo de execução de cada método RPC, sem a (de)codificação")
+        m.descrever('rpc_erros_total', "Chamadas RPC que terminaram em exceção")
+        m.descrever('http_requisicao_segundos', "Tempo total da requisição HTTP, incluindo a (de)codificação")
+        m.descrever('lock_espera_segundos', "Tempo esperando para adquirir o lock")
+        m.descrever('lock_posse_segundos', "Tempo segurando o lock")
+        m.descrever('mensagens_roteadas_total', "Mensagens por rota decidida em enviar_se_no_raio")
+        m.descrever('cache_alcance_total', "Consultas ao cache de alcance mútuo por par de usuários")
+        m.medidor('usuarios', lambda: len(self.usuarios), "Usuários registrados")
+        m.medidor('usuarios_online', lambda: self.online, "Usuários com status ONLINE")
+        m.medidor('caixas_de_entrada_mensagens', lambda: sum(fatia.caixa.total() for fatia in self.fatias),
+                  "Mensagens síncronas aguardando entrega")
+        m.medidor('diretorio_versao', lambda: self.versao, "Versão atual do diretório")
+        m.descrever('encaminhamentos_total', "Chamadas encaminhadas ao nó dono do usuário")
+        m.descrever('replicas_recebidas_total', "Registros recebidos de outros nós do cluster")
+
+    def _listMethods(self):
+        return list_public_methods(self)
+
+    def _dispatch(self, metodo, params):
+        try:
+            funcao = resolve_dotted_attribute(self, metodo, False)
+        except AttributeError:
+            raise Exception(f'method "{metodo}" is not supported')
+        inicio = time.perf_counter()
+        try:
+            return funcao(*params)
+        except Exception:
+            self.metricas.incrementar('rpc_erros_total', metodo=metodo)
+            raise
+        finally:
+            self.metricas.observar('rpc_duracao_segundos', time.perf_counter() - inicio, metodo=metodo)
+
+    def _fatia(self, nome):
+        return self.fatias[zlib.crc32(nome.encode()) % len(self.fatias)]
+
+    def _gravar(self, nome, dados):
+        with self.lock_diretorio:
+            # O registro entra no WAL antes de a memória mudar: se ele não puder ser gravado,
+            # nada fica pela metade.
+            if self.diario is not None:
+                self.diario.registrar(nome, dados)
+            anterior = self.usuarios.get(nome)
+            self.online += (dados['status'] == 'ONLINE') - (anterior is not None and anterior['status'] == 'ONLINE')
+            self.usuarios[nome] = dados
+            self._indexar(nome)
+            self._marcar_alteracao(nome)
+            if self.cluster is not None and self.cluster.dono(nome) == self.cluster.proprio:
+                self.cluster.replicar(nome, dados)
+            if self.diario is not None and self.diario.precisa_compactar():
+                self._compactar_diario()
+
+    def _compactar_diario(self):
+        # Chamado com lock_diretorio: a cópia rasa é consistente com a rotação do WAL
+        # (os registros nunca mudam no lugar) e o instantâneo é gravado em segundo plano.
+        geracao = self.diario.rotacionar()
+        estado = dict(self.usuarios)
+        threading.Thread(target=self.diario.gravar_instantaneo, args=(estado, geracao), daemon=True).start()
+
+    def _dono_remoto(self, nome, metodo):
+        # Proxy do nó dono de `nome`, ou None se for este nó (ou se não houver cluster).
+        if self.cluster is None: return None
+        proxy = self.cluster.proxy_do_dono(nome)
+        if proxy is not None:
+            self.metricas.incrementar('encaminhamentos_total', metodo=metodo)
+        return proxy
+
+    def no_responsavel(self, nome):
+        # URL do nó que deve atender `nome`; '' fora de cluster (qualquer endereço serve).
+        return self.cluster.dono(nome) if self.cluster is not None else ''
+
+    def replicar(self, origem, colunas):
+        # Só um par do cluster replica, e só os usuários dos quais ele é dono: qualquer outro
+        # registro sobrescreveria o diretório (e o WAL) com dados de quem não manda neles.
+        if self.cluster is None: return False
+        registros = decodificar_colunar(colunas)
+        if origem not in self.cluster.pares:
+            self.metricas.incrementar('replicas_rejeitadas_total', len(registros), origem='desconhecido')
+            return False
+        aceitos = 0
+        for nome, dados in registros.items():
+            if self.cluster.dono(nome) != origem: continue
+            with self._fatia(nome).lock:
+                self._gravar(nome, dados)
+            aceitos += 1
+        self.metricas.incrementar('replicas_recebidas_total', aceitos, origem=origem)
+        if aceitos < len(registros):
+            self.metricas.incrementar('replicas_rejeitadas_total', len(registros) - aceitos, origem=origem)
+        return True
+
+    def pedir_sincronizacao(self, no):
+        # Reenfileira toda a partição local para `no` (ex.: ele acabou de reiniciar). Com o
+        # lock do diretório, nenhuma atualização posterior pode ser ultrapassada por esta cópia.
+        if self.cluster is None or no not in self.cluster.pares: return False
+        with self.lock_diretorio:
+            for nome, dados in self.usuarios.items():
+                if self.cluster.dono(nome) == self.cluster.proprio:
+                    self.cluster.replicar(nome, dados, destinos=[no])
+        return True
 
     def registrar_usuario(self, nome, lat, lon, raio):
-        with self.lock:
-            self.usuarios[nome] = {
-                'lat': float(lat),
-                'lon': float(lon),
-                'raio': float(raio),
-                'status': 'OFFLINE'
-            }
-            print(f"Usuário '{nome}' registrado/atualizado. Dados: {self.usuarios[nome]}")
-            return True
+        if len(nome.encode()) > TAMANHO_MAXIMO_NOME:
+            raise ValueError(f"nome de usuário com mais de {TAMANHO_MAXIMO_NOME} bytes")
+        dono = self._dono_remoto(nome, 'registrar_usuario')
+        if dono is not None: return dono.registrar_usuario(nome, lat, lon, raio)
+        dados = {
+            'lat': float(lat),
+            'lon': float(lon),
+            'raio': float(raio),
+            'status': 'OFFLINE'
+        }
+        fatia = self._fatia(nome)
+        with fatia.lock:
+            self._gravar(nome, dados)
+            self._acordar(fatia, nome)
+        log.debug("Usuário '%s' registrado/atualizado. Dados: %s", nome, dados)
+        return True
 
     def atualizar_localizacao(self, nome, lat, lon):
-        with self.lock:
+        dono = self._dono_remoto(nome, 'atualizar_localizacao')
+        if dono is not None: return dono.atualizar_localizacao(nome, lat, lon)
+        with self._fatia(nome).lock:
             if nome not in self.usuarios: return False
-            self.usuarios[nome]['lat'] = float(lat)
-            self.usuarios[nome]['lon'] = float(lon)
-            print(f"Localização de '{nome}' atualizada.")
-            return True
+            self._gravar(nome, {**self.usuarios[nome], 'lat': float(lat), 'lon': float(lon)})
+        log.debug("Localização de '%s' atualizada.", nome)
+        return True
 
     def atualizar_raio(self, nome, raio):
-        with self.lock:
+        dono = self._dono_remoto(nome, 'atualizar_raio')
+        if dono is not None: return dono.atualizar_raio(nome, raio)
+        with self._fatia(nome).lock:
             if nome not in self.usuarios: return False
-            self.usuarios[nome]['raio'] = float(raio)
-            print(f"Raio de '{nome}' atualizado.")
-            return True
+            self._gravar(nome, {**self.usuarios[nome], 'raio': float(raio)})
+        log.debug("Raio de '%s' atualizado.", nome)
+        return True
+
+    def atualizar_perfil(self, nome, lat, lon, raio):
+        dono = self._dono_remoto(nome, 'atualizar_perfil')
+        if dono is not None: return dono.atualizar_perfil(nome, lat, lon, raio)
+        with self._fatia(nome).lock:
+            if nome not in self.usuarios: return False
+            self._gravar(nome, {**self.usuarios[nome], 'lat': float(lat), 'lon': float(lon), 'raio': float(raio)})
+        log.debug("Perfil de '%s' atualizado.", nome)
+        return True
 
     def atualizar_status(self, nome, status):
-        with self.lock:
+        if status not in ['ONLINE', 'OFFLINE']: return False
+        dono = self._dono_remoto(nome, 'atualizar_status')
+        if dono is not None: return dono.atualizar_status(nome, status)
+        fatia = self._fatia(nome)
+        with fatia.lock:
             if nome not in self.usuarios: return False
-            if status not in ['ONLINE', 'OFFLINE']: return False
-            self.usuarios[nome]['status'] = status
-            print(f"Status de '{nome}' atualizado para {status}")
-            return True
+            self._gravar(nome, {**self.usuarios[nome], 'status': status})
+            self._acordar(fatia, nome)
+        log.debug("Status de '%s' atualizado para %s", nome, status)
+        return True
+
+    def _status(self, nome):
+        dados = self.usuarios.get(nome)
+        return dados['status'] if dados is not None else None
+
+    def _marcar_alteracao(self, nome):
+        self.versao += 1
+        self.alteracoes[nome] = self.versao
+        self.alteracoes.move_to_end(nome)
+
+    def _indexar(self, nome):
+        dados = self.usuarios[nome]
+        nova = celula_da_posicao(dados['lat'], dados['lon'])
+        antiga = self.celulas.get(nome)
+        if antiga == nova: return
+        if antiga is not None:
+            self.indice_espacial[antiga].discard(nome)
+            if not self.indice_espacial[antiga]:
+                del self.indice_espacial[antiga]
+        self.indice_espacial[nova].add(nome)
+        self.celulas[nome] = nova
+
+    def _candidatos_no_raio(self, lat, lon, raio):
+        linhas, colunas = faixas_no_raio(lat, lon, raio)
+        if len(linhas) * len(colunas) <= len(self.indice_espacial):
+            for linha in linhas:
+                for coluna in colunas:
+                    yield from self.indice_espacial.get((linha, coluna), ())
+        else:
+            colunas = set(colunas)
+            for (linha, coluna), nomes in self.indice_espacial.items():
+                if linha in linhas and coluna in colunas:
+                    yield from nomes
+
+    def usuarios_no_raio(self, nome):
+        # Consulta pontual pelo índice espacial, para scripts e clientes sem MQTT. O cliente
+        # gráfico não a usa: a lista dele também tem as seções fora do raio e offline, e é
+        # mantida pela presença MQTT (ProximityTracker), sem consultar o servidor.
+        origem = self.usuarios.get(nome)
+        if origem is None: return []
+        with self.lock_diretorio:
+            candidatos = list(self._candidatos_no_raio(origem['lat'], origem['lon'], origem['raio']))
+        resultado = []
+        for outro in candidatos:
+            if outro == nome: continue
+            dados = self.usuarios[outro]
+            dist = calcular_distancia(origem['lat'], origem['lon'], dados['lat'], dados['lon'])
+            if dist <= origem['raio']:
+                resultado.append({'nome': outro, 'dist': dist, **dados})
+        resultado.sort(key=lambda item: (item['dist'], item['nome']))
+        return resultado
 
     def get_todos_usuarios(self):
-        with self.lock:
-            return self.usuarios.copy()
+        # O instantâneo só é reconstruído quando o diretório mudou; entre mudanças
+        # todas as leituras compartilham o mesmo dicionário sem pegar lock.
+        if self.versao_instantaneo != self.versao:
+            with self.lock_diretorio:
+                if self.versao_instantaneo != self.versao:
+                    self.instantaneo = dict(self.usuarios)
+                    self.versao_instantaneo = self.versao
+        return self.instantaneo
+
+    def get_todos_usuarios_colunar(self):
+        return codificar_colunar(self.get_todos_usuarios())
+
+    def get_alteracoes_desde(self, versao, instancia='', colunar=False):
+        with self.lock_diretorio:
+            completo = instancia != self.instancia or versao <= 0 or versao > self.versao
+            alterados = {}
+            for nome in reversed(self.alteracoes):
+                if not completo and self.alteracoes[nome] <= versao: break
+                alterados[nome] = self.usuarios[nome]
+            versao_atual = self.versao
+        if colunar:
+            alterados = codificar_colunar(alterados)
+        return {'instancia': self.instancia, 'versao': versao_atual, 'completo': completo, 'usuarios': alterados}
 
     def enviar_mensagem_sincrona(self, remetente, destinatario, mensagem):
-        with self.lock:
-            if destinatario not in self.usuarios or self.usuarios[destinatario]['status'] != 'ONLINE':
+        dono = self._dono_remoto(destinatario, 'enviar_mensagem_sincrona')
+        if dono is not None: return dono.enviar_mensagem_sincrona(remetente, destinatario, mensagem)
+        msg_formatada = f"(RPC) {remetente}: {mensagem}"
+        fatia = self._fatia(destinatario)
+        with fatia.lock:
+            if self._status(destinatario) != 'ONLINE':
                 return False
+            fatia.caixa.adicionar(destinatario, msg_formatada)
+            self._acordar(fatia, destinatario)
+        log.debug("Mensagem RPC de '%s' para '%s' recebida e armazenada.", remetente, destinatario)
+        return True
 
-            msg_formatada = f"(RPC) {remetente}: {mensagem}"
-            self.caixas_de_entrada_rpc[destinatario].append(msg_formatada)
-            print(f"Mensagem RPC de '{remetente}' para '{destinatario}' recebida e armazenada.")
-            return True
+    def _alcance_mutuo(self, nome_a, dados_a, nome_b, dados_b):
+        # Cada par fica em cache enquanto os dois registros forem os mesmos objetos: mudar
+        # posição, raio ou status troca o registro e invalida o par sem nenhuma contabilidade.
+        if nome_a > nome_b:
+            nome_a, dados_a, nome_b, dados_b = nome_b, dados_b, nome_a, dados_a
+        guardado = self.cache_alcance.get((nome_a, nome_b))
+        if guardado is not None and guardado[0] is dados_a and guardado[1] is dados_b:
+            self.metricas.incrementar('cache_alcance_total', resultado='acerto')
+            return guardado[2]
+        self.metricas.incrementar('cache_alcance_total', resultado='falha')
+        dist = calcular_distancia(dados_a['lat'], dados_a['lon'], dados_b['lat'], dados_b['lon'])
+        alcance = dist <= dados_a['raio'] and dist <= dados_b['raio']
+        if len(self.cache_alcance) >= LIMITE_CACHE_ALCANCE:
+            self.cache_alcance.clear()
+        self.cache_alcance[(nome_a, nome_b)] = (dados_a, dados_b, alcance)
+        return alcance
+
+    def enviar_se_no_raio(self, remetente, destinatario, mensagem):
+        # 'RPC' se os dois estão um no raio do outro e o destinatário está online; senão 'MQTT',
+        # publicado aqui mesmo, ou 'MQTT_REMETENTE' quando o servidor não tem broker e quem
+        # publica é o remetente. 'INEXISTENTE' se algum dos dois não estiver registrado.
+        origem = self.usuarios.get(remetente)
+        alvo = self.usuarios.get(destinatario)
+        if origem is None or alvo is None:
+            return 'INEXISTENTE'
+        if (alvo['status'] == 'ONLINE' and self._alcance_mutuo(remetente, origem, destinatario, alvo)
+                and self.enviar_mensagem_sincrona(remetente, destinatario, mensagem)):
+            rota = 'RPC'
+        elif self.publicador is not None and self.publicador.publicar(f"{TOPICO_MENSAGENS}/{destinatario}", f"(MQTT) {remetente}: {mensagem}"):
+            rota = 'MQTT'
+        else:
+            rota = 'MQTT_REMETENTE'
+        self.metricas.incrementar('mensagens_roteadas_total', rota=rota)
+        return rota
 
     def receber_mensagens_sincronas(self, nome_usuario):
-        with self.lock:
-            if nome_usuario in self.caixas_de_entrada_rpc:
-                mensagens = self.caixas_de_entrada_rpc[nome_usuario]
-                self.caixas_de_entrada_rpc[nome_usuario] = []
-                return mensagens
-            return []
-
-def run_server():
-    host = '127.0.0.1'
-    port = 8000
-    server = SimpleXMLRPCServer((host, port), requestHandler=RequestHandler, allow_none=True)
+        dono = self._dono_remoto(nome_usuario, 'receber_mensagens_sincronas')
+        if dono is not None: return dono.receber_mensagens_sincronas(nome_usuario)
+        fatia = self._fatia(nome_usuario)
+        with fatia.lock:
+            return fatia.caixa.retirar(nome_usuario)
+
+    def aguardar_mensagens(self, nome_usuario, timeout):
+        dono = self._dono_remoto(nome_usuario, 'aguardar_mensagens')
+        if dono is not None: return dono.aguardar_mensagens(nome_usuario, timeout)
+        timeout = max(0.0, min(float(timeout), TEMPO_MAXIMO_ESPERA))
+        fatia = self._fatia(nome_usuario)
+        with fatia.lock:
+            status_inicial = self._status(nome_usuario)
+            fatia.condicao(nome_usuario).wait_for(
+                lambda: fatia.caixa.tem_mensagens(nome_usuario) or self._status(nome_usuario) != status_inicial,
+                timeout)
+            return fatia.caixa.retirar(nome_usuario)
+
+    def _acordar(self, fatia, nome):
+        # Chamar com o lock da fatia: acorda os long-polls de `nome`, com thread ou estacionados.
+        fatia.condicao(nome).notify_all()
+        esperas = fatia.esperas.get(nome)
+        if not esperas: return
+        tem_mensagens = fatia.caixa.tem_mensagens(nome)
+        status = self._status(nome)
+        prontas = [espera for espera in esperas if tem_mensagens or status != espera.status_inicial]
+        if not prontas: return
+        restantes = [espera for espera in esperas if espera not in prontas]
+        if restantes:
+            fatia.esperas[nome] = restantes
+        else:
+            del fatia.esperas[nome]
+        for espera in prontas:
+            espera.ao_acordar()
+
+    def _estacionar_espera(self, nome_usuario, timeout, ao_acordar):
+        # aguardar_mensagens sem thread, para o modo pool: devolve a Espera, que termina em
+        # ao_acordar() ou, vencido espera.prazo, em _cancelar_espera(); None quando a chamada
+        # deve ser atendida normalmente (já há mensagens, timeout 0 ou usuário de outro nó).
+        if self.cluster is not None and self.cluster.dono(nome_usuario) != self.cluster.proprio: return None
+        timeout = max(0.0, min(float(timeout), TEMPO_MAXIMO_ESPERA))
+        fatia = self._fatia(nome_usuario)
+        with fatia.lock:
+            if timeout == 0 or fatia.caixa.tem_mensagens(nome_usuario): return None
+            espera = Espera(nome_usuario, self._status(nome_usuario), time.monotonic() + timeout, ao_acordar)
+            fatia.esperas.setdefault(nome_usuario, []).append(espera)
+        return espera
+
+    def _cancelar_espera(self, espera):
+        # True se a espera ainda estava guardada: quem cancelou passa a ser quem responde.
+        fatia = self._fatia(espera.nome)
+        with fatia.lock:
+            esperas = fatia.esperas.get(espera.nome, [])
+            if espera not in esperas: return False
+            esperas.remove(espera)
+            if not esperas:
+                del fatia.esperas[espera.nome]
+        return True
+
+def criar_servidor(host, port, modo='threads', max_threads=32):
+    # 'simples' é o pool com uma thread: uma requisição por vez, mas sem deixar uma conexão
+    # keep-alive ou um long-poll parado bloquear os outros clientes.
+    if modo in ('simples', 'pool'):
+        return PoolXMLRPCServer((host, port), max_threads=1 if modo == 'simples' else max_threads, allow_none=True)
+    return ThreadedXMLRPCServer((host, port), requestHandler=RequestHandler, allow_none=True)
+
+def run_server(host='127.0.0.1', port=8000, modo='threads', max_threads=32, dados='dados', no=None, nos=None, mqtt=None):
+    os.makedirs(dados, exist_ok=True)
+    metricas = Metricas()
+    publicador = PublicadorMQTT(*ler_endereco(mqtt)) if mqtt else None
+    cluster = None
+    if nos:
+        # Encaminhamentos podem carregar um long-poll inteiro, por isso o timeout maior que a espera máxima.
+        cluster = Cluster(no or f"http://{host}:{port}", nos, timeout=TEMPO_MAXIMO_ESPERA + 5, conexoes=max_threads)
+    server = criar_servidor(host, port, modo, max_threads)
+    server.metricas = metricas
     server.register_introspection_functions()
-    server.register_instance(LocationServer())
-    print(f"📡 Servidor RPC iniciado em http://{host}:{port}")
+    server.register_multicall_functions()
+    server.register_function(metricas.instantaneo, 'system.metricas')
+    caixas = [CaixaPersistente(os.path.join(dados, f'caixas.{i}.db')) for i in range(NUM_FATIAS)]
+    server.register_instance(LocationServer(caixas=caixas,
+                                            diario=DiarioDeEstado(dados), metricas=metricas, cluster=cluster,
+                                            publicador=publicador))
+    log.info("📡 Servidor RPC iniciado em http://%s:%d (modo: %s, métricas em %s)", host, port, modo, CAMINHO_METRICAS)
+    if cluster is not None:
+        cluster.iniciar()
+        log.info("Nó %s de um cluster com %d nós.", cluster.proprio, len(nos))
     server.serve_forever()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Servidor RPC do Comunicador Geográfico")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--modo', choices=MODOS_SERVIDOR, default='threads',
+                        help="simples: uma requisição por vez, numa única thread; threads: uma thread por conexão (padrão); "
+                             "pool: pool limitado de threads por requisição, com long-polls estacionados sem thread")
+    parser.add_argument('--threads', type=int, default=32,
+                        help="tamanho do pool no modo 'pool' e conexões por nó vizinho em cluster")
+    parser.add_argument('--dados', default='dados',
+                        help="diretório onde ficam os arquivos persistentes do servidor")
+    parser.add_argument('--nos', type=lambda texto: [no.strip() for no in texto.split(',') if no.strip()],
+                        help="URLs de todos os nós do cluster, separadas por vírgula (mesma lista em todos os nós)")
+    parser.add_argument('--no', help="URL deste nó como aparece em --nos (padrão: http://HOST:PORT)")
+    parser.add_argument('--mqtt', metavar='HOST[:PORTA]',
+                        help="broker onde o servidor publica as mensagens assíncronas; sem isso, quem publica é o remetente")
+    parser.add_argument('--log', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="nível de log; DEBUG registra cada operação (limitado por taxa)")
+    parser.add_argument('--log-limite', type=int, default=20,
+                        help="máximo de linhas por segundo para cada tipo de mensagem de log")
+    return parser.parse_args()
+
+def configurar_log(nivel, limite):
+    saida = logging.StreamHandler()
+    saida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    saida.addFilter(LimitadorDeTaxa(limite))
+    logging.basicConfig(level=nivel, handlers=[saida])
+
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    args = parse_args()
+    configurar_log(args.log, args.log_limite)
+    run_server(args.host, args.port, args.modo, args.threads, args.dados, args.no, args.nos, args.mqtt)
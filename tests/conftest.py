@@ -0,0 +1,30 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metricas import Metricas
+from server_rpc import LocationServer, criar_servidor
+
+@pytest.fixture
+def iniciar_servidor():
+    servidores = []
+    def iniciar(modo='threads', max_threads=32):
+        server = criar_servidor('127.0.0.1', 0, modo, max_threads)
+        server.metricas = Metricas()
+        server.register_multicall_functions()
+        server.register_instance(LocationServer(metricas=server.metricas))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servidores.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+    yield iniciar
+    for server in servidores:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def url(iniciar_servidor):
+    return iniciar_servidor()
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from armazenamento import CaixaPersistente, nome_de_arquivo
+
+def test_nome_seguro_e_mantido():
+    assert nome_de_arquivo('ana_2') == 'ana_2'
+    assert nome_de_arquivo('joão') == 'joão'
+
+@pytest.mark.parametrize('nome', ['../x', 'a/b', '..', '.oculto', 'C:\\\\x', 'x' * 300, ''])
+def test_nome_inseguro_fica_dentro_do_diretorio(tmp_path, nome):
+    arquivo = nome_de_arquivo(nome)
+    assert os.sep not in arquivo and '/' not in arquivo and not arquivo.startswith('.')
+    caixa = CaixaPersistente(os.path.join(tmp_path, f"{arquivo}.db"))
+    caixa.close()
+    assert os.listdir(tmp_path)
+
+def test_nomes_diferentes_nao_colidem():
+    assert nome_de_arquivo('a/b') != nome_de_arquivo('a_b') != nome_de_arquivo('a?b')
+
+def test_limite_por_usuario_descarta_as_mais_antigas(tmp_path):
+    caixa = CaixaPersistente(os.path.join(tmp_path, 'caixa.db'), max_por_usuario=3)
+    for i in range(5):
+        caixa.adicionar('a', f"m{i}")
+    caixa.adicionar('b', 'outra')
+    assert caixa.retirar('a', limite=1) == ['m2']
+    caixa.adicionar('a', 'm5')
+    caixa.adicionar('a', 'm6')
+    assert caixa.retirar('a') == ['m4', 'm5', 'm6']
+    caixa.close()
+    # A contagem em memória é refeita a partir do banco ao reabrir.
+    caixa = CaixaPersistente(os.path.join(tmp_path, 'caixa.db'), max_por_usuario=3)
+    for i in range(3):
+        caixa.adicionar('b', f"n{i}")
+    assert caixa.retirar('b') == ['n0', 'n1', 'n2']
+    caixa.close()
@@ -0,0 +1,95 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import client_session
+from armazenamento import CaixaPersistente
+from client_session import ClientSession, MQTT_TOPIC_PRESENCE
+from protocolo import codificar_presenca
+from utils import chave_celula
+
+def _presenca(sessao, usuario, lat, lon, versao):
+    topico = f"{MQTT_TOPIC_PRESENCE}/{chave_celula(lat, lon)}/{usuario}"
+    mensagem = SimpleNamespace(topic=topico, payload=codificar_presenca('ONLINE', lat, lon, 10.0, versao).encode())
+    sessao.on_presence_message(None, None, mensagem)
+
+def test_presencas_em_rajada_viram_uma_linha_de_log(monkeypatch):
+    monkeypatch.setattr(client_session, 'PRESENCE_LOG_WINDOW', 0.05)
+    linhas = []
+    async def cenario():
+        sessao = ClientSession('eu', -3.74, -38.52, 50.0, None, None, None, on_log=linhas.append)
+        # Carga inicial (presenças retidas): 100 contatos no raio.
+        for i in range(100):
+            _presenca(sessao, f"u{i}", -3.74 + i * 1e-4, -38.52, 1)
+        await asyncio.sleep(0.1)
+        assert linhas == ["[SISTEMA] 100 contatos entraram no seu raio."]
+        # Evento isolado continua nominal.
+        _presenca(sessao, 'u0', 0.0, 0.0, 2)
+        await asyncio.sleep(0.1)
+        assert linhas[1:] == ["[SISTEMA] u0 atualizou a localização. Atualizando lista...",
+                              "[SISTEMA] u0 saiu do seu raio."]
+        # Recálculo em massa ao mudar o próprio raio.
+        sessao.proximity.set_origin(-3.74, -38.52, 0.001)
+        await asyncio.sleep(0.1)
+        assert linhas[3:] == ["[SISTEMA] 99 contatos saíram do seu raio."]
+    asyncio.run(cenario())
+
+class _Mqtt:
+    def __init__(self):
+        self.assinados = set()
+        self.publicados = []
+
+    async def connect(self, will_topic=None, will_payload=None):
+        return True
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        self.publicados.append((topic, payload, retain))
+
+    def subscribe(self, topic, qos=1, callback=None):
+        self.assinados.add(topic)
+
+    def unsubscribe(self, topic):
+        self.assinados.discard(topic)
+
+class _Rpc:
+    def __init__(self):
+        self.system = SimpleNamespace(multicall=self.multicall)
+
+    async def multicall(self, chamadas):
+        return [[True] for _ in chamadas]
+
+def test_assinaturas_de_presenca_da_execucao_anterior_sao_canceladas(tmp_path):
+    # A sessão MQTT persistente guarda as assinaturas no broker de uma execução para a outra.
+    broker = _Mqtt()
+    async def entrar(raio):
+        buffer = CaixaPersistente(os.path.join(tmp_path, 'eu.db'))
+        sessao = ClientSession('eu', -3.74, -38.52, raio, _Rpc(), broker, buffer)
+        assert await sessao.start()
+        buffer.close()
+        return sessao
+
+    asyncio.run(entrar(20000.0))
+    assert f"{MQTT_TOPIC_PRESENCE}/+/+" in broker.assinados
+    sessao = asyncio.run(entrar(10.0))
+    presenca = {topico for topico in broker.assinados if topico.startswith(MQTT_TOPIC_PRESENCE)}
+    assert presenca == {f"{MQTT_TOPIC_PRESENCE}/{celula}/+" for celula in sessao.subscribed_cells}
+    assert '+' not in sessao.subscribed_cells
+
+def test_reconexao_ao_broker_republica_a_presenca_e_refaz_as_assinaturas(tmp_path):
+    broker = _Mqtt()
+    async def cenario():
+        buffer = CaixaPersistente(os.path.join(tmp_path, 'eu.db'))
+        sessao = ClientSession('eu', -3.74, -38.52, 10.0, _Rpc(), broker, buffer)
+        assert await sessao.start()
+        buffer.close()
+        return sessao
+
+    sessao = asyncio.run(cenario())
+    # Broker reiniciado sem a sessão: o Last Will marcou OFFLINE e as assinaturas se perderam.
+    broker.assinados.clear()
+    broker.publicados.clear()
+    broker.on_reconnect()
+    assert broker.assinados == {f"{MQTT_TOPIC_PRESENCE}/{celula}/+" for celula in sessao.subscribed_cells} | {sessao.personal_topic}
+    [(topico, payload, retida)] = broker.publicados
+    assert topico == sessao._presence_topic() and retida
+    assert payload == codificar_presenca('ONLINE', -3.74, -38.52, 10.0, sessao.presence_version)
@@ -0,0 +1,71 @@
+import threading
+import time
+import xmlrpc.client
+
+import pytest
+
+from protocolo import ProxyJSON
+
+THREADS_SERVIDOR = 4
+CLIENTES_EM_LONG_POLL = THREADS_SERVIDOR + 2
+
+@pytest.mark.parametrize('modo', ['simples', 'threads', 'pool'])
+def test_long_polls_alem_do_tamanho_do_pool_nao_travam_o_servidor(iniciar_servidor, modo):
+    # Cada cliente online deixa uma conexão presa em aguardar_mensagens, como o App faz.
+    url = iniciar_servidor(modo, THREADS_SERVIDOR)
+    admin = ProxyJSON(url, timeout=5)
+    nomes = [f"u{i}" for i in range(CLIENTES_EM_LONG_POLL)]
+    for nome in nomes + ['remetente']:
+        admin.registrar_usuario(nome, -3.74, -38.52, 50.0)
+        admin.atualizar_status(nome, 'ONLINE')
+
+    recebidas = {}
+    def aguardar(nome):
+        recebidas[nome] = ProxyJSON(url, timeout=15).aguardar_mensagens(nome, 10)
+    threads = [threading.Thread(target=aguardar, args=(nome,), daemon=True) for nome in nomes]
+    for t in threads: t.start()
+    time.sleep(0.5)
+
+    novo = ProxyJSON(url, timeout=3)
+    inicio = time.perf_counter()
+    assert novo.registrar_usuario('atrasado', -3.74, -38.52, 50.0)
+    assert novo.enviar_se_no_raio('remetente', nomes[-1], 'oi') == 'RPC'
+    assert time.perf_counter() - inicio < 2
+
+    threads[-1].join(timeout=5)
+    assert recebidas[nomes[-1]] == ['(RPC) remetente: oi']
+    # Mudança de status acorda os demais long-polls antes de o servidor ser fechado.
+    for nome in nomes[:-1]:
+        admin.atualizar_status(nome, 'OFFLINE')
+    for t in threads: t.join(timeout=5)
+
+def test_long_poll_estacionado_responde_no_prazo_e_aceita_xml(iniciar_servidor):
+    url = iniciar_servidor('simples')
+    admin = ProxyJSON(url, timeout=5)
+    admin.registrar_usuario('a', -3.74, -38.52, 50.0)
+    admin.atualizar_status('a', 'ONLINE')
+
+    # Sem nada a entregar, a resposta vem vazia quando o prazo vence, pela mesma conexão.
+    cliente = ProxyJSON(url, timeout=5)
+    inicio = time.perf_counter()
+    assert cliente.aguardar_mensagens('a', 0.5) == []
+    assert 0.4 < time.perf_counter() - inicio < 3
+    assert cliente.receber_mensagens_sincronas('a') == []
+
+    recebidas = []
+    xml = xmlrpc.client.ServerProxy(f"{url}/RPC2", allow_none=True)
+    espera = threading.Thread(target=lambda: recebidas.append(xml.aguardar_mensagens('a', 10)))
+    espera.start()
+    time.sleep(0.3)
+    assert admin.enviar_mensagem_sincrona('b', 'a', 'oi')
+    espera.join(timeout=5)
+    assert recebidas == [['(RPC) b: oi']]
+
+def test_modo_simples_alterna_entre_conexoes_keep_alive(iniciar_servidor):
+    url = iniciar_servidor('simples')
+    clientes = [ProxyJSON(url, timeout=3) for _ in range(3)]
+    inicio = time.perf_counter()
+    for rodada in range(3):
+        for i, cliente in enumerate(clientes):
+            assert cliente.registrar_usuario(f"u{i}", -3.74, -38.52, float(rodada + 1))
+    assert time.perf_counter() - inicio < 1
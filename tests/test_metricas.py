@@ -0,0 +1,37 @@
+import urllib.error
+import urllib.request
+
+from cluster import Cluster
+from metricas import Metricas
+from protocolo import codificar_colunar
+from server_rpc import LocationServer
+
+def _series(texto, nome):
+    return [linha for linha in texto.splitlines() if linha.startswith(nome + '_count')]
+
+def test_caminhos_desconhecidos_nao_criam_series(url):
+    for i in range(20):
+        try:
+            urllib.request.urlopen(urllib.request.Request(f"{url}/aleatorio{i}", b"{}", method='POST'), timeout=5)
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+    texto = urllib.request.urlopen(f"{url}/metrics", timeout=5).read().decode()
+    assert _series(texto, 'http_requisicao_segundos') == ['http_requisicao_segundos_count{caminho="outro"} 20']
+
+def test_replicacao_so_aceita_pares_donos_dos_registros():
+    metricas = Metricas()
+    nos = ['http://a', 'http://b', 'http://c']
+    servidor = LocationServer(metricas=metricas, cluster=Cluster('http://a', nos))
+    registro = {'lat': 0.0, 'lon': 0.0, 'raio': 10.0, 'status': 'ONLINE'}
+    nomes = [f"u{i}" for i in range(100)]
+    dono_b = next(nome for nome in nomes if servidor.cluster.dono(nome) == 'http://b')
+    dono_c = next(nome for nome in nomes if servidor.cluster.dono(nome) == 'http://c')
+    for origem in ('http://x', 'http://y'):
+        assert servidor.replicar(origem, codificar_colunar({dono_b: registro})) is False
+    assert servidor.usuarios == {}
+    assert servidor.replicar('http://b', codificar_colunar({dono_b: registro, dono_c: registro})) is True
+    assert servidor.usuarios == {dono_b: registro}
+    contadores = metricas.instantaneo()['contadores']
+    assert contadores == {'replicas_recebidas_total{origem="http://b"}': 1,
+                          'replicas_rejeitadas_total{origem="http://b"}': 1,
+                          'replicas_rejeitadas_total{origem="desconhecido"}': 2}
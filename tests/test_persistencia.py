@@ -0,0 +1,26 @@
+import pytest
+
+from persistencia import DiarioDeEstado
+from server_rpc import LocationServer
+
+def test_registros_enfileirados_sobrevivem_ao_reinicio(tmp_path):
+    servidor = LocationServer(diario=DiarioDeEstado(tmp_path))
+    for i in range(1000):
+        servidor.registrar_usuario(f"u{i}", i / 100, -38.5, 10.0)
+    servidor.atualizar_status('u7', 'ONLINE')
+    servidor.diario.close()
+
+    recuperado = LocationServer(diario=DiarioDeEstado(tmp_path))
+    assert recuperado.usuarios == servidor.usuarios
+    assert recuperado.online == 1
+    recuperado.diario.close()
+
+def test_registro_que_nao_cabe_no_wal_nao_fica_so_na_memoria(tmp_path):
+    servidor = LocationServer(diario=DiarioDeEstado(tmp_path))
+    with pytest.raises(ValueError):
+        servidor.registrar_usuario('x' * 70000, 0.0, 0.0, 10.0)
+    # Mesmo por um caminho sem a validação do nome (ex.: réplica), o WAL vem antes da memória.
+    with pytest.raises(ValueError):
+        servidor._gravar('y' * 70000, {'lat': 0.0, 'lon': 0.0, 'raio': 1.0, 'status': 'OFFLINE'})
+    assert servidor.usuarios == {} and servidor.versao == 0
+    servidor.diario.close()
@@ -0,0 +1,31 @@
+import http.client
+import json
+from urllib.parse import urlsplit
+
+import pytest
+
+from protocolo import ERRO_PEDIDO_INVALIDO, despachar_json
+from server_rpc import LocationServer
+
+@pytest.mark.parametrize('corpo', ['5', '"x"', 'null', '[]', '{"params": []}', '{"method": "get_todos_usuarios", "params": {}}'])
+def test_pedido_que_nao_e_objeto_devolve_invalid_request(corpo):
+    resposta = json.loads(despachar_json(LocationServer(), corpo))
+    assert resposta['error']['code'] == ERRO_PEDIDO_INVALIDO
+
+def test_lote_com_itens_invalidos_responde_cada_item():
+    corpo = json.dumps([1, {'jsonrpc': '2.0', 'method': 'no_responsavel', 'params': ['ana'], 'id': 7}])
+    invalido, valido = json.loads(despachar_json(LocationServer(), corpo))
+    assert invalido['error']['code'] == ERRO_PEDIDO_INVALIDO
+    assert valido == {'jsonrpc': '2.0', 'result': '', 'id': 7}
+
+@pytest.mark.parametrize('caminho', ['/JSON', '/RPC2'])
+@pytest.mark.parametrize('tamanho, status', [(None, 411), ('abc', 400)])
+def test_content_length_ausente_ou_invalido(url, caminho, tamanho, status):
+    partes = urlsplit(url)
+    conexao = http.client.HTTPConnection(partes.hostname, partes.port, timeout=5)
+    conexao.putrequest('POST', caminho, skip_accept_encoding=True)
+    if tamanho is not None:
+        conexao.putheader('Content-Length', tamanho)
+    conexao.endheaders()
+    assert conexao.getresponse().status == status
+    conexao.close()
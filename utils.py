@@ -1,7 +1,17 @@
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, degrees, sin, cos, sqrt, atan2, asin, floor, ceil, pi
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RAIO_TERRA_KM = 6371.0
+KM_POR_GRAU = RAIO_TERRA_KM * pi / 180
+TAMANHO_CELULA = 0.5
+TAMANHO_CELULA_TOPICO = 1.0
 
 def calcular_distancia(lat1, lon1, lat2, lon2):
-    R = 6371.0
+    R = RAIO_TERRA_KM
 
     lat1_rad = radians(lat1)
     lon1_rad = radians(lon1)
@@ -15,4 +25,107 @@ def calcular_distancia(lat1, lon1, lat2, lon2):
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
     distancia = R * c
-    return distancia
\ No newline at end of file
+    return distancia
+
+def _linha(lat, tamanho):
+    linhas = int(ceil(180 / tamanho))
+    return min(int(floor((lat + 90) / tamanho)), linhas - 1)
+
+def _coluna(lon, tamanho):
+    colunas = int(ceil(360 / tamanho))
+    return int(floor(((lon + 180) % 360) / tamanho)) % colunas
+
+def celula_da_posicao(lat, lon, tamanho=TAMANHO_CELULA):
+    return (_linha(lat, tamanho), _coluna(lon, tamanho))
+
+def _caixa_delimitadora(lat, raio):
+    # Meia-altura e meia-largura (graus) da calota esférica de raio `raio` km centrada em `lat`.
+    # dlon None indica que a calota alcança um polo e cobre todas as longitudes.
+    dlat = raio / KM_POR_GRAU
+    if lat - dlat <= -90 or lat + dlat >= 90:
+        return dlat, None
+    razao = sin(radians(dlat)) / cos(radians(lat))
+    if razao >= 1:
+        return dlat, None
+    return dlat, degrees(asin(razao))
+
+def faixas_no_raio(lat, lon, raio, tamanho=TAMANHO_CELULA):
+    colunas = int(ceil(360 / tamanho))
+    dlat, dlon = _caixa_delimitadora(lat, raio)
+    linhas = range(_linha(max(lat - dlat, -90.0), tamanho), _linha(min(lat + dlat, 90.0), tamanho) + 1)
+    if dlon is None:
+        return linhas, list(range(colunas))
+    inicio = _coluna(lon - dlon, tamanho)
+    quantidade = min(int(ceil(2 * dlon / tamanho)) + 1, colunas)
+    return linhas, [(inicio + i) % colunas for i in range(quantidade)]
+
+def celulas_no_raio(lat, lon, raio, tamanho=TAMANHO_CELULA):
+    linhas, colunas = faixas_no_raio(lat, lon, raio, tamanho)
+    return [(linha, coluna) for linha in linhas for coluna in colunas]
+
+def chave_celula(lat, lon, tamanho=TAMANHO_CELULA_TOPICO):
+    linha, coluna = celula_da_posicao(lat, lon, tamanho)
+    return f"{linha}_{coluna}"
+
+def chaves_celulas_no_raio(lat, lon, raio, tamanho=TAMANHO_CELULA_TOPICO):
+    # Células (como segmento de tópico MQTT) que cobrem o raio, sempre incluindo a própria.
+    chaves = {f"{linha}_{coluna}" for linha, coluna in celulas_no_raio(lat, lon, raio, tamanho)}
+    chaves.add(chave_celula(lat, lon, tamanho))
+    return chaves
+
+def _exigir_numpy():
+    if np is None:
+        raise ImportError("numpy é necessário para o cálculo vetorizado de distâncias (pip install numpy).")
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    a = np.clip(a, 0.0, 1.0)
+    return RAIO_TERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def calcular_distancias(lat, lon, lats, lons, raio=None):
+    # Versão vetorizada de calcular_distancia de um ponto para vários.
+    # Com `raio`, os pontos fora da caixa delimitadora nem chegam ao haversine e ficam com inf.
+    _exigir_numpy()
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if raio is None:
+        return _haversine(lat, lon, lats, lons)
+
+    dlat, dlon = _caixa_delimitadora(lat, raio)
+    candidatos = np.abs(lats - lat) <= dlat
+    if dlon is not None:
+        candidatos &= np.abs((lons - lon + 180) % 360 - 180) <= dlon
+    distancias = np.full(lats.shape, np.inf)
+    distancias[candidatos] = _haversine(lat, lon, lats[candidatos], lons[candidatos])
+    return distancias
+
+def matriz_distancias(lats1, lons1, lats2, lons2, raio=None):
+    # Distâncias de todos para todos: resultado com formato (len(lats1), len(lats2)).
+    # `raio` (um valor ou um por linha) funciona como em calcular_distancias: pares fora da
+    # caixa delimitadora de cada linha ficam com inf sem passar pelo haversine. Cada linha só
+    # olha a faixa de latitudes dela (busca binária em lats2 ordenado), não a matriz inteira.
+    _exigir_numpy()
+    lats1 = np.asarray(lats1, dtype=float)
+    lons1 = np.asarray(lons1, dtype=float)
+    lats2 = np.asarray(lats2, dtype=float)
+    lons2 = np.asarray(lons2, dtype=float)
+    if raio is None:
+        return _haversine(lats1[:, None], lons1[:, None], lats2[None, :], lons2[None, :])
+
+    raios = np.broadcast_to(np.asarray(raio, dtype=float), lats1.shape)
+    caixas = [_caixa_delimitadora(lat, r) for lat, r in zip(lats1.tolist(), raios.tolist())]
+    dlat = np.array([caixa[0] for caixa in caixas])
+    dlon = np.array([np.inf if caixa[1] is None else caixa[1] for caixa in caixas])
+    ordem = np.argsort(lats2, kind='stable')
+    lats_ordenadas = lats2[ordem]
+    inicio = np.searchsorted(lats_ordenadas, lats1 - dlat, side='left')
+    quantos = np.searchsorted(lats_ordenadas, lats1 + dlat, side='right') - inicio
+    linhas = np.repeat(np.arange(len(lats1)), quantos)
+    deslocamento = np.arange(quantos.sum()) - np.repeat(np.cumsum(quantos) - quantos, quantos)
+    colunas = ordem[np.repeat(inicio, quantos) + deslocamento]
+    dentro = np.abs((lons2[colunas] - lons1[linhas] + 180) % 360 - 180) <= dlon[linhas]
+    linhas, colunas = linhas[dentro], colunas[dentro]
+    distancias = np.full((len(lats1), len(lats2)), np.inf)
+    distancias[linhas, colunas] = _haversine(lats1[linhas], lons1[linhas], lats2[colunas], lons2[colunas])
+    return distancias